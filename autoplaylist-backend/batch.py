@@ -0,0 +1,181 @@
+# offline batch runs of the classification pipeline — no HTTP, no user login
+#
+# reads exported libraries and runs them through the same steps as /generate
+# (dedupe -> artist genres -> cache -> local script check -> AI -> grouping).
+# every answer lands in the cache as it comes back, so this is also how a big
+# catalogue gets pre-warmed overnight. inputs can be:
+#   .json            a list of tracks, or {"tracks": [...]} / {"items": [...]}
+#   .ndjson / .jsonl one track per line (streamed), - reads stdin
+# tracks are _format_track-shaped records; raw Spotify track objects and
+# saved-track items ({"track": {...}}) are converted on the way in
+#
+#   python batch.py alice.json bob.ndjson --out results/
+#   python batch.py alice.json --options '{"decade": true, "max_genres": 20}'
+#   python batch.py catalogue.ndjson --warm-only --chunk 5000
+#
+# each library is processed on its own, so memory is bounded by the biggest
+# one. --warm-only skips grouping and streams the input --chunk tracks at a
+# time, for catalogues too big to hold at once
+#
+# artist genres come from Spotify with an app token (SPOTIPY_CLIENT_ID /
+# SPOTIPY_CLIENT_SECRET), a user's token with --token, or only from the
+# artist cache with --offline. songs the AI fails on go to the retry queue
+# in the local db, which the server's background worker picks up
+
+import argparse
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+import main as backend
+
+
+def _to_track(record: dict) -> dict | None:
+    # whatever shape the export used -> a _format_track dict (None to skip it)
+    if "track" in record and isinstance(record["track"], dict):
+        record = record["track"]
+    if record.get("track_id"):
+        record.setdefault("name", "")
+        record.setdefault("artists", [])
+        return record
+    if record.get("id") and isinstance(record.get("album"), dict):
+        return backend._format_track(record)
+    return None  # local files and podcast episodes have no usable id
+
+
+def _read_records(path: str):
+    if path == "-" or path.endswith((".ndjson", ".jsonl")):
+        f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("tracks") or data.get("items") or []
+    yield from data
+
+
+def _read_tracks(path: str):
+    for record in _read_records(path):
+        track = _to_track(record)
+        if track:
+            yield track
+
+
+def _chunks(iterable, size: int):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _library_name(path: str) -> str:
+    return "stdin" if path == "-" else os.path.splitext(os.path.basename(path))[0]
+
+
+def _summary(name: str, tracks: int, progress: "backend.Progress", seconds: float) -> dict:
+    p = progress.snapshot()
+    return {
+        "library": name,
+        "tracks": tracks,
+        "cached": p["llm_cached"],
+        "sent_to_ai": p["llm_tracks_done"],
+        "deferred": p["llm_deferred"],
+        "seconds": round(seconds, 2),
+        "timings": progress.timings,
+    }
+
+
+def run_library(sp, path: str, opts: dict, compact: bool) -> tuple[dict, dict]:
+    # the whole pipeline for one library, returns (result, summary)
+    progress = backend.Progress()
+    started = time.perf_counter()
+    progress.set(stage="fetching_tracks")  # reading the file stands in for the Spotify fetch
+    library = backend.Library.from_tracks(_read_tracks(path))
+    result = backend._process_tracks(sp, library, opts, progress)
+    progress.set(stage="done")
+    if compact:
+        result = backend._compact_result(result)
+    return result, _summary(_library_name(path), len(library), progress, time.perf_counter() - started)
+
+
+def warm_library(sp, path: str, opts: dict, chunk: int) -> dict:
+    # classification only, streamed. each chunk goes through artist genres,
+    # cache, script check and AI on its own, no grouping or track details get
+    # built; songs repeated across chunks are answered from the cache the
+    # earlier chunk filled
+    progress = backend.Progress()
+    started = time.perf_counter()
+    count = 0
+    for tracks in _chunks(_read_tracks(path), chunk):
+        library = backend.Library.from_tracks(tracks)
+        count += len(library)
+        backend._classify_library(sp, library, opts, progress)
+    progress.set(stage="done")
+    return _summary(_library_name(path), count, progress, time.perf_counter() - started)
+
+
+def _spotify_client(args):
+    if args.offline:
+        return None
+    if args.token:
+        return backend.get_spotify_client(f"Bearer {args.token}")
+    return backend.get_app_spotify_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the AutoPlaylist pipeline over exported libraries")
+    parser.add_argument("inputs", nargs="+", help="library files (.json, .ndjson, .jsonl), - for NDJSON on stdin")
+    parser.add_argument("--out", help="write <library>.json here (default: one JSON line per library on stdout)")
+    parser.add_argument("--options", default="{}", help='/generate options as JSON, e.g. \'{"decade": true}\'')
+    parser.add_argument("--compact", action="store_true", help="write results in the compact format")
+    parser.add_argument("--warm-only", action="store_true", help="only classify and fill the cache, no grouping")
+    parser.add_argument("--chunk", type=int, default=5000, help="tracks per step with --warm-only")
+    parser.add_argument("--offline", action="store_true", help="don't call Spotify, use cached artist genres only")
+    parser.add_argument("--token", default=os.getenv("SPOTIFY_TOKEN"), help="a user's Spotify access token instead of an app token")
+    args = parser.parse_args()
+
+    try:
+        opts = json.loads(args.options)
+    except json.JSONDecodeError as e:
+        parser.error(f"--options isn't valid JSON: {e}")
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    backend._init_db()
+    sp = _spotify_client(args)
+    failed = 0
+    for path in args.inputs:
+        name = _library_name(path)
+        try:
+            if args.warm_only:
+                summary = warm_library(sp, path, opts, args.chunk)
+            else:
+                result, summary = run_library(sp, path, opts, args.compact)
+                if args.out:
+                    with open(os.path.join(args.out, f"{name}.json"), "w", encoding="utf-8") as f:
+                        json.dump(result, f, ensure_ascii=False)
+                else:
+                    print(json.dumps({"library": name, **result}, ensure_ascii=False), flush=True)
+        except Exception as e:
+            # one broken export shouldn't stop the rest of the batch
+            print(f"{name}: failed ({e})", file=sys.stderr)
+            failed += 1
+            continue
+        print(
+            f"{name}: {summary['tracks']} tracks, {summary['cached']} cached, "
+            f"{summary['sent_to_ai']} sent to the AI, {summary['deferred']} deferred, {summary['seconds']}s",
+            file=sys.stderr,
+        )
+
+    if backend.http_session.built:
+        backend.http_session.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# a tiny in-memory server that speaks enough of the Redis protocol (RESP)
+# for RedisCache: hashes, pipelined HGETALL/HSET, SCAN, DEL, in RESP2 or
+# RESP3 (newer redis-py clients open with HELLO 3). lets the shared cache
+# backend be run and benchmarked without a real Redis
+#
+#   python -m bench.fake_redis --port 6390
+#   CACHE_URL=redis://127.0.0.1:6390 uvicorn main:app
+
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class Store:
+    def __init__(self):
+        self.data: dict[bytes, dict[bytes, bytes]] = {}
+        self.lock = threading.Lock()
+
+
+STORE = Store()
+
+
+def _encode(value, resp3: bool = False) -> bytes:
+    # python value -> reply. dicts are maps in RESP3 and flat arrays in RESP2
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, Exception):
+        return f"-ERR {value}\r\n".encode()
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, dict):
+        if resp3:
+            return b"%%%d\r\n" % len(value) + b"".join(
+                _encode(k, resp3) + _encode(v, resp3) for k, v in value.items()
+            )
+        value = [x for kv in value.items() for x in kv]
+    return b"*%d\r\n" % len(value) + b"".join(_encode(v, resp3) for v in value)
+
+
+def _scan(args: list[bytes]):
+    cursor = int(args[0])
+    pattern, count = "*", 10
+    for i in range(1, len(args) - 1, 2):
+        option = args[i].upper()
+        if option == b"MATCH":
+            pattern = args[i + 1].decode()
+        elif option == b"COUNT":
+            count = int(args[i + 1])
+    # the cursor is just an offset into the sorted keys, good enough for a stand-in
+    with STORE.lock:
+        keys = sorted(STORE.data)
+    page = keys[cursor:cursor + count]
+    next_cursor = cursor + count if cursor + count < len(keys) else 0
+    return [str(next_cursor).encode(), [k for k in page if fnmatch.fnmatchcase(k.decode(), pattern)]]
+
+
+def execute(args: list[bytes]):
+    command = args[0].upper()
+    with STORE.lock:
+        if command == b"PING":
+            return "PONG"
+        if command in (b"SELECT", b"CLIENT"):
+            return "OK"
+        if command == b"HSET":
+            fields = STORE.data.setdefault(args[1], {})
+            added = 0
+            for i in range(2, len(args) - 1, 2):
+                added += args[i] not in fields
+                fields[args[i]] = args[i + 1]
+            return added
+        if command == b"HGETALL":
+            return dict(STORE.data.get(args[1], {}))
+        if command == b"DEL":
+            return sum(STORE.data.pop(k, None) is not None for k in args[1:])
+        if command == b"DBSIZE":
+            return len(STORE.data)
+        if command == b"FLUSHDB":
+            STORE.data.clear()
+            return "OK"
+    if command == b"SCAN":
+        return _scan(args[1:])
+    return ValueError(f"unknown command '{command.decode()}'")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    resp3 = False
+
+    def _read_command(self) -> list[bytes] | None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # inline command, e.g. from telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if args and args[0].upper() == b"HELLO":
+                # protocol switch, answered with the server info map
+                self.resp3 = len(args) > 1 and args[1] == b"3"
+                reply = {b"server": b"redis", b"version": b"7.4.0", b"proto": 3 if self.resp3 else 2,
+                         b"id": 1, b"mode": b"standalone", b"role": b"master", b"modules": []}
+                self.wfile.write(_encode(reply, self.resp3))
+            elif args:
+                self.wfile.write(_encode(execute(args), self.resp3))
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port: int = 0) -> Server:
+    # starts the server on a background thread and returns it (port 0 = any free port)
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="in-memory Redis-protocol stand-in for the shared cache")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    srv = serve(args.port)
+    print(f"fake redis at redis://127.0.0.1:{srv.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,387 @@
+# stand-in servers for the Spotify Web API and Groq's chat completions API
+# so the backend can be benchmarked without real accounts or API keys
+#
+# one HTTP server answers both: /v1/... is Spotify, /openai/v1/... is Groq.
+# the library is synthetic (see make_library) and the knobs — latency, 429s,
+# cut-off AI answers — can be changed while it runs through /_bench/config
+#
+#   python -m bench.fake_servers --port 9900 --tracks 5000
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# -------------------------------------------------------------------
+# Synthetic library
+# -------------------------------------------------------------------
+
+GENRES = [
+    "pop", "dance pop", "indie rock", "alternative rock", "hip hop", "trap", "r&b",
+    "k-pop", "j-pop", "bollywood", "latin pop", "reggaeton", "edm", "house", "techno",
+    "metal", "country", "folk", "jazz", "classical", "lo-fi", "punk", "soul", "afrobeats",
+]
+LLM_GENRES = ["Pop", "Rock", "Hip-Hop", "Electronic", "R&B", "Indie", "Jazz", "Folk"]
+WORDS = ["love", "night", "fire", "dream", "city", "heart", "summer", "rain", "gold", "blue",
+         "wild", "echo", "light", "home", "ocean", "road", "stars", "ghost", "neon", "river"]
+# a few non-Latin titles so the local script check has something to do
+SCRIPT_TITLES = {
+    "Japanese": ["さくら", "夜に駆ける", "ありがとう", "ひまわり"],
+    "Korean": ["사랑해", "봄날", "다시 만나", "별빛"],
+    "Russian": ["Звезда", "Ночь", "Кукушка", "Город"],
+    "Hindi": ["दिल से", "तुम ही हो", "मेरा दिल", "सपना"],
+}
+EDITION_TAGS = [" - Remastered 2011", " - Radio Edit", " (Deluxe Edition)", " - Single Version"]
+
+
+def make_library(n_tracks: int, seed: int = 1, dup_rate: float = 0.1, script_rate: float = 0.15,
+                 no_genre_rate: float = 0.3) -> dict:
+    # n_tracks liked songs by ~n/8 artists. some artists have no Spotify genres
+    # (so genre needs the AI), some titles are in non-Latin scripts, and
+    # dup_rate of the songs are other releases (album/deluxe) of an earlier one
+    rng = random.Random(seed)
+    n_artists = max(5, n_tracks // 8)
+    artists = {}
+    for i in range(n_artists):
+        aid = f"ar{i:06d}"
+        genres = [] if rng.random() < no_genre_rate else rng.sample(GENRES, rng.randint(1, 3))
+        artists[aid] = {"id": aid, "name": f"Artist {i}", "genres": genres, "type": "artist"}
+    artist_ids = list(artists)
+
+    tracks = []
+    for i in range(n_tracks):
+        if tracks and rng.random() < dup_rate:
+            # another release of a song we already have: new id, same ISRC or a tagged title
+            orig = rng.choice(tracks)
+            track = json.loads(json.dumps(orig))
+            track["id"] = f"tr{i:07d}"
+            if rng.random() < 0.5:
+                track["name"] = orig["name"] + rng.choice(EDITION_TAGS)
+                track["external_ids"] = {"isrc": f"ZZ{i:010d}"}
+            track["album"]["name"] = orig["album"]["name"] + " (Deluxe)"
+            tracks.append(track)
+            continue
+        main_artist = rng.choice(artist_ids)
+        credited = [main_artist] + (rng.sample(artist_ids, 1) if rng.random() < 0.2 else [])
+        if rng.random() < script_rate:
+            name = rng.choice(SCRIPT_TITLES[rng.choice(list(SCRIPT_TITLES))]) + f" {i}"
+        else:
+            name = " ".join(rng.sample(WORDS, rng.randint(1, 3))).title()
+        tracks.append({
+            "id": f"tr{i:07d}",
+            "name": name,
+            "type": "track",
+            "artists": [{"id": a, "name": artists[a]["name"]} for a in credited],
+            "album": {"name": f"Album {i // 10}", "release_date": f"{rng.randint(1965, 2024)}-01-01"},
+            "external_ids": {"isrc": f"QZ{i:010d}"},
+            "duration_ms": 200000,
+        })
+    rng.shuffle(tracks)
+    return {"tracks": tracks, "artists": artists}
+
+
+# -------------------------------------------------------------------
+# Server state
+# -------------------------------------------------------------------
+
+DEFAULT_CONFIG = {
+    "spotify_latency_ms": 20,     # per Spotify request
+    "spotify_429_rate": 0.0,      # chance a Spotify request gets a 429
+    "spotify_retry_after": 0,     # Retry-After seconds sent with those 429s
+    "saved_page_max": 50,         # Spotify's own max limit for /me/tracks
+    "playlist_page_max": 100,     # ... and for /playlists/{id}/tracks
+    "groq_latency_ms": 250,       # per Groq call
+    "groq_ms_per_song": 8,        # plus this per song in the batch
+    "groq_429_rate": 0.0,         # chance a Groq call gets a 429
+    "groq_truncate_rate": 0.0,    # chance an answer gets cut off mid-JSON
+    "groq_chars_per_token": 4,    # how completion_tokens is worked out
+    "visible_fraction": 1.0,      # share of liked songs the API shows (oldest first), for partial-warm runs
+}
+
+
+class State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config = dict(DEFAULT_CONFIG)
+        self.rng = random.Random(7)
+        self.library = make_library(0)
+        self.playlists: dict[str, dict] = {}  # playlists created through the API
+        self.stats: dict[str, int] = {}
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def liked(self) -> list[dict]:
+        tracks = self.library["tracks"]
+        visible = int(len(tracks) * self.config["visible_fraction"])
+        return tracks[len(tracks) - visible:]  # newest first, so hiding the head = "added later"
+
+
+STATE = State()
+
+
+def _snapshot(track_ids: list[str]) -> str:
+    return hashlib.sha1(",".join(track_ids).encode()).hexdigest()[:16]
+
+
+# -------------------------------------------------------------------
+# Request handling
+# -------------------------------------------------------------------
+
+_SONG_LINE = re.compile(r"^(\d+)\. (.*) — (.*)$")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body=None, headers: dict | None = None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else None
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _route(self, method: str):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method in ("POST", "DELETE") else None
+        path = url.path.rstrip("/")
+        if path.startswith("/_bench"):
+            return self._bench(method, path, body)
+        if path.startswith("/openai/v1/chat/completions"):
+            return self._groq(body)
+        if path.startswith("/v1/"):
+            return self._spotify(method, path[len("/v1/"):], query, body)
+        self._send(404, {"error": {"status": 404, "message": "not found"}})
+
+    # --- control endpoints for the harness ---
+
+    def _bench(self, method: str, path: str, body):
+        if path == "/_bench/stats":
+            with STATE.lock:
+                stats = dict(STATE.stats)
+            return self._send(200, stats)
+        if path == "/_bench/reset-stats":
+            with STATE.lock:
+                STATE.stats = {}
+            return self._send(200, {})
+        if path == "/_bench/config":
+            with STATE.lock:
+                STATE.config.update(body or {})
+                config = dict(STATE.config)
+            return self._send(200, config)
+        if path == "/_bench/library":
+            library = make_library(**(body or {}))
+            with STATE.lock:
+                STATE.library = library
+                STATE.playlists = {}
+            return self._send(200, {"tracks": len(library["tracks"]), "artists": len(library["artists"])})
+        self._send(404, {})
+
+    # --- Spotify ---
+
+    def _spotify(self, method: str, path: str, query: dict, body):
+        cfg = STATE.config
+        STATE.count("spotify_requests")
+        if cfg["spotify_latency_ms"]:
+            time.sleep(cfg["spotify_latency_ms"] / 1000)
+        if STATE.chance(cfg["spotify_429_rate"]):
+            STATE.count("spotify_429s")
+            return self._send(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                              {"Retry-After": cfg["spotify_retry_after"]})
+
+        limit, offset = int(query.get("limit", 20)), int(query.get("offset", 0))
+        parts = path.split("/")
+
+        if path == "me":
+            return self._send(200, {"id": "bench", "display_name": "Bench User"})
+        if path == "me/tracks":
+            if limit > cfg["saved_page_max"]:
+                return self._send(400, {"error": {"status": 400, "message": "Invalid limit"}})
+            liked = STATE.liked()
+            page = liked[offset:offset + limit]
+            return self._send(200, {
+                "items": [{"added_at": "2024-01-01T00:00:00Z", "track": t} for t in page],
+                "total": len(liked), "limit": limit, "offset": offset,
+                "next": "more" if offset + limit < len(liked) else None,
+            })
+        if path == "me/playlists":
+            with STATE.lock:
+                items = [
+                    {"id": pid, "name": p["name"], "owner": {"id": "bench"}, "tracks": {"total": len(p["tracks"])}}
+                    for pid, p in STATE.playlists.items()
+                ]
+            return self._send(200, {
+                "items": items[offset:offset + limit], "total": len(items),
+                "next": "more" if offset + limit < len(items) else None,
+            })
+        if path == "artists":
+            ids = (query.get("ids") or "").split(",")
+            artists = STATE.library["artists"]
+            return self._send(200, {"artists": [artists.get(a) for a in ids]})
+        if parts[0] == "users" and len(parts) == 3 and method == "POST":
+            with STATE.lock:
+                pid = f"pl{len(STATE.playlists):06d}"
+                STATE.playlists[pid] = {"name": body["name"], "tracks": []}
+            STATE.count("spotify_playlists_created")
+            return self._send(201, {"id": pid, "name": body["name"]})
+        if parts[0] == "playlists" and len(parts) >= 2:
+            return self._spotify_playlist(method, parts, query, body, limit, offset)
+        self._send(404, {"error": {"status": 404, "message": "not found"}})
+
+    def _spotify_playlist(self, method: str, parts: list[str], query: dict, body, limit: int, offset: int):
+        pid = parts[1]
+        with STATE.lock:
+            playlist = STATE.playlists.get(pid)
+        if playlist is None:
+            return self._send(404, {"error": {"status": 404, "message": "Not found"}})
+        by_id = {t["id"]: t for t in STATE.library["tracks"]}
+
+        if len(parts) == 2 and method == "GET":
+            return self._send(200, {
+                "id": pid, "name": playlist["name"],
+                "snapshot_id": _snapshot(playlist["tracks"]), "tracks": {"total": len(playlist["tracks"])},
+            })
+        if parts[2] == "tracks" and method == "GET":
+            if limit > STATE.config["playlist_page_max"]:
+                return self._send(400, {"error": {"status": 400, "message": "Invalid limit"}})
+            page = playlist["tracks"][offset:offset + limit]
+            return self._send(200, {
+                "items": [{"track": by_id.get(tid)} for tid in page],
+                "total": len(playlist["tracks"]),
+                "next": "more" if offset + limit < len(playlist["tracks"]) else None,
+            })
+        if parts[2] == "tracks" and method == "POST":
+            uris = body if isinstance(body, list) else body.get("uris", [])
+            with STATE.lock:
+                playlist["tracks"].extend(u.rsplit(":", 1)[-1] for u in uris)
+                snapshot = _snapshot(playlist["tracks"])
+            STATE.count("spotify_tracks_added", len(uris))
+            return self._send(201, {"snapshot_id": snapshot})
+        if parts[2] == "tracks" and method == "DELETE":
+            gone = {t["uri"].rsplit(":", 1)[-1] for t in body.get("tracks", [])}
+            with STATE.lock:
+                playlist["tracks"] = [tid for tid in playlist["tracks"] if tid not in gone]
+                snapshot = _snapshot(playlist["tracks"])
+            STATE.count("spotify_tracks_removed", len(gone))
+            return self._send(200, {"snapshot_id": snapshot})
+        self._send(404, {"error": {"status": 404, "message": "not found"}})
+
+    # --- Groq ---
+
+    def _groq(self, body):
+        cfg = STATE.config
+        prompt = body["messages"][-1]["content"]
+        songs = [m.groups() for line in prompt.splitlines() if (m := _SONG_LINE.match(line))]
+        STATE.count("groq_requests")
+        STATE.count("groq_songs", len(songs))
+        time.sleep((cfg["groq_latency_ms"] + cfg["groq_ms_per_song"] * len(songs)) / 1000)
+        headers = {
+            "x-ratelimit-remaining-requests": 10000, "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-remaining-tokens": 10000000, "x-ratelimit-reset-tokens": "1s",
+        }
+        if STATE.chance(cfg["groq_429_rate"]):
+            STATE.count("groq_429s")
+            return self._send(429, {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                              {**headers, "retry-after": 1})
+
+        want_language, want_genre = '"l"' in prompt, '"g"' in prompt
+        answers = []
+        for number, title, artists in songs:
+            entry = {"n": int(number)}
+            if want_language:
+                entry["l"] = _guess_language(title)
+            if want_genre:
+                entry["g"] = LLM_GENRES[int(hashlib.md5(artists.encode()).hexdigest(), 16) % len(LLM_GENRES)]
+            answers.append(entry)
+        content = json.dumps(answers)
+
+        # answers longer than max_tokens get cut off the way a real model's would
+        max_chars = int(body.get("max_tokens") or 10 ** 9) * cfg["groq_chars_per_token"]
+        finish = "stop"
+        if len(content) > max_chars:
+            content, finish = content[:max_chars], "length"
+        elif len(content) > 2 and STATE.chance(cfg["groq_truncate_rate"]):
+            content, finish = content[:STATE.rng.randint(1, len(content) - 1)], "length"
+        if finish == "length":
+            STATE.count("groq_truncated")
+
+        usage_prompt = len(prompt) // cfg["groq_chars_per_token"]
+        usage_completion = len(content) // cfg["groq_chars_per_token"]
+        self._send(200, {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish}],
+            "usage": {"prompt_tokens": usage_prompt, "completion_tokens": usage_completion,
+                      "total_tokens": usage_prompt + usage_completion},
+        }, headers)
+
+
+def _guess_language(title: str) -> str:
+    for ch in title:
+        if "぀" <= ch <= "ヿ" or "一" <= ch <= "鿿":
+            return "Japanese"
+        if "가" <= ch <= "힯":
+            return "Korean"
+        if "Ѐ" <= ch <= "ӿ":
+            return "Russian"
+        if "ऀ" <= ch <= "ॿ":
+            return "Hindi"
+    return "Spanish" if sum(map(ord, title)) % 7 == 0 else "English"
+
+
+def serve(port: int = 0, tracks: int = 0, seed: int = 1) -> ThreadingHTTPServer:
+    # starts the server on a background thread and returns it (port 0 = any free port)
+    if tracks:
+        STATE.library = make_library(tracks, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fake Spotify + Groq APIs for benchmarking")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    srv = serve(args.port, args.tracks, args.seed)
+    print(f"fake Spotify at http://127.0.0.1:{srv.server_port}/v1/, "
+          f"fake Groq at http://127.0.0.1:{srv.server_port} ({args.tracks} liked songs)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
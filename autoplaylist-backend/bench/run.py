@@ -0,0 +1,276 @@
+# offline benchmark for /generate and /create-playlists
+#
+# starts the fake Spotify + Groq server (bench/fake_servers.py) in its own
+# process, points the backend at it and runs the real pipeline over synthetic
+# libraries, cold / warm / partially warm. prints per-stage timings,
+# throughput, peak memory and how many API calls each run cost
+#
+#   cd autoplaylist-backend
+#   python -m bench.run --sizes 100,1000,10000 --states cold,warm,partial
+#   python -m bench.run --sizes 50000 --states cold --spotify-429-rate 0.02 --groq-truncate-rate 0.1
+#   python -m bench.run --cache redis   # shared cache backend, against bench/fake_redis.py
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["fetching_tracks", "resolving_artists", "classifying", "grouping"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeServer:
+    # the fake APIs in a child process, so they don't fight the backend for the GIL
+    def __init__(self):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_servers", "--port", str(self.port), "--tracks", "0"],
+            cwd=BACKEND_DIR, stdout=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                self.call("stats")
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("fake server didn't start")
+
+    def call(self, what: str, body: dict | None = None) -> dict:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(f"{self.url}/_bench/{what}", data=data, method="POST" if data else "GET")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+class FakeRedis:
+    # bench/fake_redis.py in a child process, for --cache redis
+    def __init__(self):
+        self.port = _free_port()
+        self.url = f"redis://127.0.0.1:{self.port}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_redis", "--port", str(self.port)],
+            cwd=BACKEND_DIR, stdout=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("fake redis didn't start")
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def _load_backend(server: FakeServer, db_dir: str, cache_url: str = ""):
+    # env has to be in place before main.py is imported, anything already set wins
+    env = {
+        "SPOTIFY_API_URL": f"{server.url}/v1/",
+        "GROQ_BASE_URL": server.url,
+        "GROQ_API_KEY": "bench",
+        "SPOTIPY_CLIENT_ID": "bench",
+        "SPOTIPY_CLIENT_SECRET": "bench",
+        "SPOTIPY_REDIRECT_URI": "http://127.0.0.1/callback",
+        "DB_PATH": os.path.join(db_dir, "cache.db"),
+        "CACHE_URL": cache_url,
+        # no free-tier throttling unless asked for, so the fake's speed is what gets measured
+        "GROQ_RPM": "100000",
+        "GROQ_TPM": "1000000000",
+    }
+    for k, v in env.items():
+        os.environ.setdefault(k, v)
+    sys.path.insert(0, BACKEND_DIR)
+    import main as backend
+    backend._init_db()  # normally the server's startup hook does this
+    return backend
+
+
+def _reset_caches(backend):
+    # cold start: empty caches (local or shared), empty in-memory cache, adaptive state back to defaults
+    for namespace in backend.SQLiteCache.TABLES:
+        backend.cache.clear(namespace)
+    con = backend._db()
+    with con:
+        for table in ("llm_pending", "jobs"):
+            con.execute(f"DELETE FROM {table}")
+    backend.song_lru = backend.LRUCache(backend.SONG_CACHE_LRU_SIZE)
+    backend.groq_batch_size = backend.BatchSizer(backend.GROQ_BATCH_START, backend.GROQ_BATCH_MIN, backend.GROQ_BATCH_MAX)
+    backend.groq_breaker = backend.CircuitBreaker(
+        backend.GROQ_BREAKER_FAILURES, backend.GROQ_BREAKER_SECONDS, backend.GROQ_BREAKER_MAX_SECONDS
+    )
+
+
+def _generate(backend, sp) -> dict:
+    progress = backend.Progress()
+    started = time.perf_counter()
+    result = backend._run_pipeline(sp, ["liked"], {}, progress)
+    progress.set(stage="done")  # closes off the last stage's timing
+    return {"seconds": time.perf_counter() - started, "timings": progress.timings, "result": result}
+
+
+def _create(backend, sp, result: dict) -> float:
+    # every generated group becomes a playlist, the same as selecting all of them in the UI
+    entries, names = [], set()
+    for kind, groups in result["results"].items():
+        for name, track_ids in groups.items():
+            label = name if name not in names else f"{name} ({kind})"
+            names.add(label)
+            entries.append({"name": label, "track_ids": track_ids})
+    started = time.perf_counter()
+    backend._create_playlists(sp, {"playlists": entries, "mode": "update", "prune": True})
+    return time.perf_counter() - started
+
+
+def _measure(fn, memory: bool):
+    if memory:
+        tracemalloc.start()
+    try:
+        out = fn()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6 if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return out, peak
+
+
+def run_scenario(backend, server: FakeServer, size: int, state: str, args) -> dict:
+    sp = backend.get_spotify_client("Bearer bench")
+    server.call("library", {"n_tracks": size, "seed": args.seed})
+    _reset_caches(backend)
+
+    # get the caches (and the user's AP: playlists) into the state we want to measure from
+    if state in ("warm", "partial"):
+        if state == "partial":
+            # the user ran it before, then liked (1 - fraction) more songs since
+            server.call("config", {"visible_fraction": args.partial_fraction})
+        warm_up = _generate(backend, sp)
+        if not args.skip_create:
+            _create(backend, sp, warm_up["result"])
+        server.call("config", {"visible_fraction": 1.0})
+
+    server.call("reset-stats")
+    run, peak = _measure(lambda: _generate(backend, sp), not args.no_memory)
+    stats = server.call("stats")
+    row = {
+        "tracks": size,
+        "state": state,
+        "seconds": round(run["seconds"], 3),
+        "tracks_per_second": round(size / run["seconds"], 1) if run["seconds"] else None,
+        "peak_mb": round(peak, 1) if peak is not None else None,
+        "stages": {stage: run["timings"].get(stage, 0.0) for stage in STAGES},
+        "spotify_requests": stats.get("spotify_requests", 0),
+        "spotify_429s": stats.get("spotify_429s", 0),
+        "groq_requests": stats.get("groq_requests", 0),
+        "groq_songs": stats.get("groq_songs", 0),
+        "groq_429s": stats.get("groq_429s", 0),
+        "groq_truncated": stats.get("groq_truncated", 0),
+    }
+
+    if not args.skip_create:
+        # cold creates every playlist, warm/partial update the ones the warm-up made
+        server.call("reset-stats")
+        seconds, create_peak = _measure(lambda: _create(backend, sp, run["result"]), not args.no_memory)
+        stats = server.call("stats")
+        row["create"] = {
+            "seconds": round(seconds, 3),
+            "peak_mb": round(create_peak, 1) if create_peak is not None else None,
+            "spotify_requests": stats.get("spotify_requests", 0),
+            "playlists_created": stats.get("spotify_playlists_created", 0),
+            "tracks_added": stats.get("spotify_tracks_added", 0),
+        }
+    return row
+
+
+def _print_table(rows: list[dict]):
+    header = ["tracks", "state", "total_s", "fetch", "artists", "classify", "group",
+              "tracks/s", "peak_MB", "spotify", "429s", "groq", "groq_songs", "cut_off", "create_s", "create_calls"]
+    lines = [header]
+    for r in rows:
+        create = r.get("create") or {}
+        lines.append([
+            r["tracks"], r["state"], r["seconds"],
+            *(r["stages"][s] for s in STAGES),
+            r["tracks_per_second"], r["peak_mb"] if r["peak_mb"] is not None else "-",
+            r["spotify_requests"], r["spotify_429s"] + r["groq_429s"], r["groq_requests"], r["groq_songs"],
+            r["groq_truncated"], create.get("seconds", "-"), create.get("spotify_requests", "-"),
+        ])
+    widths = [max(len(str(line[i])) for line in lines) for i in range(len(header))]
+    for line in lines:
+        print("  ".join(str(v).rjust(w) for v, w in zip(line, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark /generate and /create-playlists against fake APIs")
+    parser.add_argument("--sizes", default="100,1000,5000", help="comma-separated library sizes (100 to 50000)")
+    parser.add_argument("--states", default="cold,warm,partial", help="cache states to run: cold, warm, partial")
+    parser.add_argument("--partial-fraction", type=float, default=0.8, help="share of the library already cached for 'partial'")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spotify-latency-ms", type=float, default=20)
+    parser.add_argument("--spotify-429-rate", type=float, default=0.0)
+    parser.add_argument("--groq-latency-ms", type=float, default=250)
+    parser.add_argument("--groq-ms-per-song", type=float, default=8)
+    parser.add_argument("--groq-429-rate", type=float, default=0.0)
+    parser.add_argument("--groq-truncate-rate", type=float, default=0.0)
+    parser.add_argument("--cache", default="sqlite", choices=["sqlite", "redis"],
+                        help="cache backend: local sqlite, or the Redis one against bench/fake_redis.py")
+    parser.add_argument("--skip-create", action="store_true", help="don't benchmark /create-playlists")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows big runs down)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    states = [s for s in args.states.split(",") if s]
+    for state in states:
+        if state not in ("cold", "warm", "partial"):
+            parser.error(f"unknown state {state!r}")
+
+    server = FakeServer()
+    redis = FakeRedis() if args.cache == "redis" else None
+    try:
+        server.call("config", {
+            "spotify_latency_ms": args.spotify_latency_ms,
+            "spotify_429_rate": args.spotify_429_rate,
+            "groq_latency_ms": args.groq_latency_ms,
+            "groq_ms_per_song": args.groq_ms_per_song,
+            "groq_429_rate": args.groq_429_rate,
+            "groq_truncate_rate": args.groq_truncate_rate,
+        })
+        with tempfile.TemporaryDirectory() as db_dir:
+            backend = _load_backend(server, db_dir, redis.url if redis else "")
+            rows = []
+            for size in sizes:
+                for state in states:
+                    print(f"running {size} tracks, {state} cache...", file=sys.stderr)
+                    rows.append(run_scenario(backend, server, size, state, args))
+    finally:
+        server.stop()
+        if redis:
+            redis.stop()
+
+    _print_table(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
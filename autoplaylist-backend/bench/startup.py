@@ -0,0 +1,163 @@
+# cold start benchmark — how long a fresh process takes to import main.py,
+# run the startup hook and answer its first requests
+#
+# every run is a new python process (a warm interpreter would hide exactly
+# the import cost this is about), against a throwaway db. requests go
+# straight into the ASGI app, so no HTTP client gets imported for them
+#
+#   cd autoplaylist-backend
+#   python -m bench.startup --runs 10
+#   python -m bench.startup --importtime 15       # slowest imports of one run
+#   python -m bench.startup --idle-ms 500         # first login half a second after boot
+#   python -m bench.startup --max-ms 400          # exit 1 if the median got slower
+#
+# `login` is the first route that needs a real client. the server builds them
+# in the background once it's up (PREWARM_CLIENTS), so with a little --idle-ms
+# they're usually ready by then; PREWARM_CLIENTS=0 shows the fully lazy cost
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["import", "startup", "first_request", "login", "total"]
+
+
+async def _get(app, path: str) -> int:
+    # one GET through the ASGI app, returns the status code
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app({
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8888),
+    }, receive, send)
+    return status
+
+
+def _child(idle_ms: float):
+    # runs inside the fresh process, prints the timings (ms) as one JSON line
+    # (total leaves out the idle time)
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    timings = {"import": time.perf_counter() - started}
+
+    async def serve():
+        t = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            timings["startup"] = time.perf_counter() - t
+            t = time.perf_counter()
+            assert await _get(main.app, "/") == 200
+            timings["first_request"] = time.perf_counter() - t
+            await asyncio.sleep(idle_ms / 1000)
+            t = time.perf_counter()
+            assert await _get(main.app, "/login") == 307
+            timings["login"] = time.perf_counter() - t
+            timings["total"] = time.perf_counter() - started - idle_ms / 1000
+
+    asyncio.run(serve())
+    print(json.dumps({k: round(v * 1000, 1) for k, v in timings.items()}))
+
+
+def _env(db_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": os.path.join(db_dir, "cache.db"),
+        "GROQ_API_KEY": env.get("GROQ_API_KEY", "bench"),
+        "SPOTIPY_CLIENT_ID": env.get("SPOTIPY_CLIENT_ID", "bench"),
+        "SPOTIPY_CLIENT_SECRET": env.get("SPOTIPY_CLIENT_SECRET", "bench"),
+        "SPOTIPY_REDIRECT_URI": env.get("SPOTIPY_REDIRECT_URI", "http://127.0.0.1/callback"),
+    })
+    return env
+
+
+def run_once(db_dir: str, idle_ms: float) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.startup", "--child", "--idle-ms", str(idle_ms)],
+        cwd=BACKEND_DIR, env=_env(db_dir), capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(db_dir: str, top: int) -> list[tuple[str, float]]:
+    # cumulative ms of main itself and of each module it imports directly,
+    # from python -X importtime (deeper imports are already counted in those)
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=_env(db_dir), capture_output=True, text=True, check=True,
+    )
+    lines = [line.split("|") for line in out.stderr.splitlines()]
+    lines = [(parts[2].rstrip(), int(parts[1]) / 1000) for parts in lines if len(parts) == 3 and parts[1].strip().isdigit()]
+    # importtime prints children before their parent, so walk it backwards
+    totals, inside_main = [], False
+    for name, ms in reversed(lines):
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            inside_main = name.strip() == "main"
+            if inside_main:
+                totals.append((name.strip(), ms))
+        elif inside_main and depth == 1:
+            totals.append((name.strip(), ms))
+    return sorted(totals, key=lambda kv: -kv[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure cold start: import, startup hook and first requests")
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes to time")
+    parser.add_argument("--idle-ms", type=float, default=0, help="wait this long after the first request before /login")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="also list the N slowest imports")
+    parser.add_argument("--max-ms", type=float, help="fail if the median total is slower than this")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.idle_ms)
+        return
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        runs = [run_once(db_dir, args.idle_ms) for _ in range(args.runs)]
+        imports = slowest_imports(db_dir, args.importtime) if args.importtime else []
+
+    summary = {
+        phase: {
+            "median_ms": round(statistics.median(r[phase] for r in runs), 1),
+            "min_ms": min(r[phase] for r in runs),
+            "max_ms": max(r[phase] for r in runs),
+        }
+        for phase in PHASES
+    }
+    width = max(len(p) for p in PHASES)
+    print(f"{'phase'.ljust(width)}  median_ms  min_ms  max_ms   ({args.runs} runs)")
+    for phase in PHASES:
+        s = summary[phase]
+        print(f"{phase.ljust(width)}  {s['median_ms']:>9}  {s['min_ms']:>6}  {s['max_ms']:>6}")
+    if imports:
+        print("\nslowest imports (cumulative ms):")
+        for name, ms in imports:
+            print(f"  {ms:8.1f}  {name}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": runs, "summary": summary, "imports": imports}, f, indent=2)
+
+    if args.max_ms is not None and summary["total"]["median_ms"] > args.max_ms:
+        print(f"median total {summary['total']['median_ms']}ms is over --max-ms {args.max_ms}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,59 @@
+from __future__ import annotations
+
 import os
+import uuid
+import asyncio
 import sqlite3
 import json
 import re
-from groq import Groq
+import time
+import threading
+import functools
+import bisect
+import unicodedata
+from array import array
+import base64
+import hashlib
+import importlib
+from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, wait as futures_wait
+from contextlib import asynccontextmanager
+import anyio
 from fastapi import FastAPI, Request, Header, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from spotipy.cache_handler import CacheHandler
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # creates/migrates the db, picks up any /generate jobs that were cut off
+    # by the last shutdown and starts draining the AI retry queue in the background
+    _init_db()
+    _resume_jobs()
+    _jobs_stop.clear()
+    threading.Thread(target=_job_lease_worker, name="job-lease", daemon=True).start()
+    _pending_stop.clear()
+    threading.Thread(target=_pending_worker, name="llm-retry", daemon=True).start()
+    if PREWARM_CLIENTS:
+        threading.Thread(target=_prewarm_clients, name="prewarm", daemon=True).start()
+    yield
+    _jobs_stop.set()
+    _pending_stop.set()
+    # only the clients something actually used were ever built
+    if http_session.built:
+        http_session.shutdown()
+    if groq_http.built:
+        groq_http.close()
+    if auth_http.built:
+        await auth_http.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # needed this so the browser doesn't block requests from localhost:5173 to localhost:8888
 # basically React and FastAPI run on different ports, without this nothing works
@@ -27,6 +67,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip for anything over 1KB the browser says it can take (SSE streams are left alone)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # these are the permissions we need from the user's Spotify account
 # read their playlists, read their liked songs, and create new playlists
 SCOPE = (
@@ -36,87 +79,1422 @@ SCOPE = (
     "playlist-modify-public"
 )
 
+# -------------------------------------------------------------------
+# Metrics — counters and timings for the whole process, served in the
+# Prometheus text format on /metrics. kept in-house (no prometheus_client)
+# since it's a handful of numbers behind one lock
+# -------------------------------------------------------------------
+
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRIC_HELP = {
+    "spotify_requests_total": ("counter", "Spotify API responses by status code"),
+    "spotify_retries_total": ("counter", "Spotify requests retried inside the connection pool, by status"),
+    "spotify_rate_limit_waits_total": ("counter", "429s that made _spotify_call wait for Retry-After"),
+    "song_cache_lookups_total": ("counter", "song_cache lookups by result (hit/miss)"),
+    "groq_batches_total": ("counter", "Groq batch calls by outcome"),
+    "groq_songs_total": ("counter", "songs sent to / answered by Groq"),
+    "groq_tokens_total": ("counter", "Groq tokens used, by kind"),
+    "groq_rate_limited_total": ("counter", "Groq 429 responses"),
+    "groq_request_seconds": ("histogram", "time spent on one Groq call"),
+    "pipeline_stage_seconds": ("histogram", "time spent in each /generate stage"),
+    "cache_errors_total": ("counter", "shared cache calls that failed, by operation"),
+    "generate_jobs_total": ("counter", "finished /generate jobs by status"),
+    "generate_tracks_total": ("counter", "tracks in /generate runs, by whether they were processed or reused from the last run"),
+    "create_playlists_total": ("counter", "playlists synced by /create-playlists, by action"),
+    "jobs_active": ("gauge", "/generate jobs queued or running"),
+    "llm_pending": ("gauge", "songs waiting in the AI retry queue"),
+    "groq_circuit_open": ("gauge", "1 while the Groq circuit breaker is open or testing"),
+    "groq_batch_size": ("gauge", "songs per Groq call right now"),
+}
+
+
+class Metrics:
+    def __init__(self):
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(METRIC_BUCKETS) + 2)
+            for i, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        def fmt(labels) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        lines, described = [], set()
+
+        def describe(name: str, kind: str):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), h in histograms:
+            describe(name, "histogram")
+            for bound, n in zip(METRIC_BUCKETS, h):
+                lines.append(f"{name}_bucket{fmt(labels + (('le', f'{bound:g}'),))} {n}")
+            lines.append(f"{name}_bucket{fmt(labels + (('le', '+Inf'),))} {h[-1]}")
+            lines.append(f"{name}_sum{fmt(labels)} {h[-2]:g}")
+            lines.append(f"{name}_count{fmt(labels)} {h[-1]}")
+        for name, value in (gauges or {}).items():
+            describe(name, "gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# -------------------------------------------------------------------
+# Lazy construction — groq, spotipy, requests and httpx take a few hundred
+# ms to import and the clients below open pools and read config, none of
+# which a fresh process needs before it can serve. so a cold start doesn't
+# pay for them up front: a Lazy builds its object the first time something
+# touches it (once, even with several threads asking at the same time) and
+# then forwards attribute access to it. modules work the same way — `groq.Groq(...)` or
+# `except spotipy.SpotifyException` import the package on first use
+# -------------------------------------------------------------------
+
+class Lazy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self.built = False
+
+    def get(self):
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    self._value = self._factory()
+                    self.built = True
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def _lazy_module(name: str) -> Lazy:
+    return Lazy(lambda: importlib.import_module(name))
+
+
+groq = _lazy_module("groq")
+httpx = _lazy_module("httpx")
+spotipy = _lazy_module("spotipy")
+requests = _lazy_module("requests")  # spotipy lets its timeouts and connection errors through
+
+
+# -------------------------------------------------------------------
+# Shared HTTP transport — every request used to build its own spotipy
+# session (and /callback a bare requests.post), so each one paid for a
+# fresh TLS handshake to the same few hosts. now there's one keep-alive
+# pool per process for the Spotify API, one for the token exchange and
+# one for Groq
+# -------------------------------------------------------------------
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))           # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))                # spotify 429/5xx retries inside the pool
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))             # AI answers can take a while to write
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]"), only groq's client can use it
+try:
+    import h2  # noqa: F401
+    HTTP2 = os.getenv("HTTP2", "1") == "1"
+except ImportError:
+    HTTP2 = False
+
+
+def _count_spotify_response(response, *args, **kwargs):
+    metrics.inc("spotify_requests_total", status=str(response.status_code))
+
+
+def _build_http_session():
+    import http.cookiejar
+    import requests
+    import urllib3
+
+    class SharedSession(requests.Session):
+        # spotipy closes its session in __del__, which would drop the pooled
+        # connections every time a per-request client gets garbage collected
+        def close(self):
+            pass
+
+        def shutdown(self):
+            super().close()
+
+    class CountingRetry(urllib3.Retry):
+        # urllib3 retries 429s/5xx before spotipy (or the response hook) ever sees them
+        def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+            metrics.inc("spotify_retries_total", status=str(response.status) if response is not None else "error")
+            return super().increment(method, url, response, error, *args, **kwargs)
+
+    session = SharedSession()
+    # same retry policy spotipy builds for itself, urllib3 honours Retry-After on 429s
+    retry = CountingRetry(
+        total=HTTP_RETRIES,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=HTTP_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry, pool_block=False
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # shared between users, so never let a cookie from one response ride along on another
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    session.hooks["response"].append(_count_spotify_response)
+    return session
+
+
+http_session = Lazy(_build_http_session)
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL")  # only set to point at a stand-in server
+# (Groq's client reads GROQ_BASE_URL from the environment on its own)
+
+groq_http = Lazy(lambda: httpx.Client(
+    http2=HTTP2,
+    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+    timeout=httpx.Timeout(GROQ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+))
+
+
+# the token exchange is the one Spotify call simple enough to do natively async
+auth_http = Lazy(lambda: httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+))
+
+
 # sets up the Spotify OAuth flow using credentials from .env
 # this handles the login redirect and token exchange
-class NoCache(CacheHandler):
-    def get_cached_token(self): return None
-    def save_token_to_cache(self, token): pass
-        # to ensure concurrent uses.
-sp_oauth = SpotifyOAuth(
-    client_id=os.getenv("SPOTIPY_CLIENT_ID"),
-    client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
-    redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI"),
-    scope=SCOPE,
-)
+def _build_sp_oauth():
+    # one object shared by every user, so it must never cache a token anywhere
+    class NoCache(spotipy.CacheHandler):
+        def get_cached_token(self): return None
+        def save_token_to_cache(self, token): pass
+
+    return spotipy.SpotifyOAuth(
+        client_id=os.getenv("SPOTIPY_CLIENT_ID"),
+        client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+        redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI"),
+        scope=SCOPE,
+        cache_handler=NoCache(),
+        requests_session=http_session.get(),
+        requests_timeout=HTTP_TIMEOUT,
+    )
+
+
+sp_oauth = Lazy(_build_sp_oauth)
 
 # groq is the AI we use for language detection and genre fallback
 # switched from Gemini because Groq is free with no credit card needed
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# max_retries=0 because the batch scheduler below does its own rate-limit aware retrying
+groq_client = Lazy(lambda: groq.Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0, http_client=groq_http.get()))
+
+# builds the clients on a background thread once the server is up, so the first
+# login or /generate usually finds them ready without the import sitting in
+# front of the server accepting connections
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "1") == "1"
+
+
+def _prewarm_clients():
+    for client in (sp_oauth, groq_client, auth_http):
+        try:
+            client.get()
+        except Exception as e:
+            # e.g. no GROQ_API_KEY, the route that needs it will raise properly
+            print(f"prewarm failed: {e}")
 
 # -------------------------------------------------------------------
 # SQLite cache — so we don't call the AI API for the same song twice
 # the db file gets created automatically next to main.py
 # if you delete it, it just recreates on next startup (you lose cache though)
+#
+# every thread keeps one long-lived connection instead of opening a new one
+# per call, and the db runs in WAL mode so readers don't block the writer
+# (FastAPI's threadpool, job workers and groq batches all hit it at once)
 # -------------------------------------------------------------------
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "cache.db")
+DB_PATH = os.getenv("DB_PATH") or os.path.join(os.path.dirname(__file__), "cache.db")
+
+# sqlite caps the number of ? in one query (999 on older builds), so big
+# IN (...) lookups are split into chunks of this size
+SQLITE_CHUNK = 500
+
+# how many song_cache rows we also keep in memory
+SONG_CACHE_LRU_SIZE = int(os.getenv("SONG_CACHE_LRU_SIZE", "50000"))
+# a row still missing a field that a lookup needs is only trusted from memory this
+# long, after that it's read again in case another worker/node filled it in
+SONG_CACHE_PARTIAL_TTL = float(os.getenv("SONG_CACHE_PARTIAL_TTL", "30"))
+
+_db_local = threading.local()
+
+def _db() -> sqlite3.Connection:
+    # this thread's connection, opened the first time it's needed
+    con = getattr(_db_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, much faster commits
+        _db_local.con = con
+    return con
+
+def _select_in(sql: str, ids: list[str], params: tuple = ()) -> list[tuple]:
+    # runs `sql` (which must end in "IN ({})") once per chunk of ids
+    con = _db()
+    rows = []
+    for i in range(0, len(ids), SQLITE_CHUNK):
+        chunk = ids[i:i+SQLITE_CHUNK]
+        rows.extend(con.execute(sql.format(",".join("?" * len(chunk))), (*params, *chunk)).fetchall())
+    return rows
+
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
 
 def _init_db():
-    # creates the table if it doesn't exist yet
-    con = sqlite3.connect(DB_PATH)
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS song_cache (
-            key TEXT PRIMARY KEY,
-            language TEXT,
-            llm_genre TEXT
+    # schema setup, once per process — called from the startup hook (batch.py
+    # and the cache CLI call it themselves since they don't run one)
+    global _db_ready
+    with _db_ready_lock:
+        if not _db_ready:
+            _create_tables()
+            _db_ready = True
+
+
+def _create_tables():
+    # creates the tables if they don't exist yet
+    con = _db()
+    with con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS song_cache (
+                key TEXT PRIMARY KEY,
+                language TEXT,
+                llm_genre TEXT,
+                language_source TEXT
+            )
+        """)
+        # older cache.db files don't have language_source yet ("script" or "llm",
+        # NULL on old rows means it came from the llm)
+        columns = {row[1] for row in con.execute("PRAGMA table_info(song_cache)")}
+        if "language_source" not in columns:
+            con.execute("ALTER TABLE song_cache ADD COLUMN language_source TEXT")
+        # artist genres from Spotify — shared by every user, refreshed after ARTIST_CACHE_TTL_DAYS
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS artist_cache (
+                artist_id TEXT PRIMARY KEY,
+                name TEXT,
+                genres TEXT,
+                fetched_at REAL
+            )
+        """)
+        # what most of an artist's songs turned out to be, so their other songs
+        # can skip the AI — counts are kept so we know how sure we were
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS artist_inference (
+                artist_id TEXT PRIMARY KEY,
+                language TEXT,
+                language_votes INTEGER,
+                llm_genre TEXT,
+                genre_votes INTEGER,
+                updated_at REAL,
+                language_source TEXT
+            )
+        """)
+        # older rows counted script-detected songs as language votes, those
+        # have no language_source and their language is ignored (see _artist_consensus)
+        columns = {row[1] for row in con.execute("PRAGMA table_info(artist_inference)")}
+        if "language_source" not in columns:
+            con.execute("ALTER TABLE artist_inference ADD COLUMN language_source TEXT")
+        # formatted track lists per playlist, only refetched when the snapshot_id changes
+        # liked songs are stored under "liked:<user id>" with no snapshot
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS playlist_cache (
+                key TEXT PRIMARY KEY,
+                snapshot_id TEXT,
+                total INTEGER,
+                format INTEGER,
+                tracks TEXT,
+                fetched_at REAL
+            )
+        """)
+        # songs the AI failed on, retried off the request path by _pending_worker
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS llm_pending (
+                track_id TEXT PRIMARY KEY,
+                track TEXT,
+                need_language INTEGER,
+                need_genre INTEGER,
+                attempts INTEGER,
+                next_attempt_at REAL,
+                last_error TEXT
+            )
+        """)
+        # what the last /generate for a user + playlist selection grouped each track
+        # into, so a rerun only has to process the songs that changed
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS generation_state (
+                key TEXT PRIMARY KEY,
+                signature TEXT,
+                state TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        # background /generate jobs, so they survive a restart
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT,
+                request TEXT,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        # which process is running a job, and updated_at doubles as its lease
+        # (see _resume_jobs) — older cache.db files don't have the column yet
+        columns = {row[1] for row in con.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            con.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+
+# -------------------------------------------------------------------
+# Cache backends — the song, artist, playlist and generation caches all
+# go through `cache`, so several workers or replicas can share one.
+# a namespace is one kind of cache, a value is a flat dict of JSON-able
+# fields. CACHE_URL picks the backend:
+#   unset / sqlite     the tables above in DB_PATH (one node only)
+#   redis://host:6379  a Redis server (or anything that speaks its
+#                      protocol), needs the redis package
+# jobs and llm_pending always stay in the local db, they belong to the node
+# running them
+# -------------------------------------------------------------------
+
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_BATCH = 500  # keys per round trip for the network backend
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get_many(self, namespace: str, keys: list[str]) -> dict[str, dict]:
+        # {key: value} for the keys that are stored, fields that were never set may be missing
+        ...
+
+    @abstractmethod
+    def set_many(self, namespace: str, items: dict[str, dict], merge: bool = False):
+        # merge=True: None fields keep whatever is stored, otherwise the value is replaced
+        ...
+
+    @abstractmethod
+    def export(self, namespace: str):
+        # yields (key, value) for everything in the namespace, for warming another node
+        ...
+
+    @abstractmethod
+    def clear(self, namespace: str):
+        ...
+
+
+class SQLiteCache(CacheBackend):
+    # namespace -> (table, key column, value columns, columns stored as JSON text)
+    TABLES = {
+        "song": ("song_cache", "key", ("language", "llm_genre", "language_source"), ()),
+        "artist": ("artist_cache", "artist_id", ("name", "genres", "fetched_at"), ("genres",)),
+        "artist_inference": (
+            "artist_inference", "artist_id",
+            ("language", "language_votes", "llm_genre", "genre_votes", "updated_at", "language_source"), (),
+        ),
+        "playlist": ("playlist_cache", "key", ("snapshot_id", "total", "format", "tracks", "fetched_at"), ("tracks",)),
+        "generation": ("generation_state", "key", ("signature", "state", "created_at", "updated_at"), ("state",)),
+    }
+
+    def _row_to_value(self, namespace: str, row: tuple) -> dict:
+        _, _, columns, json_columns = self.TABLES[namespace]
+        value = dict(zip(columns, row))
+        for c in json_columns:
+            if value[c] is not None:
+                value[c] = json.loads(value[c])
+        return value
+
+    def get_many(self, namespace, keys):
+        if not keys:
+            return {}
+        table, key_column, columns, _ = self.TABLES[namespace]
+        rows = _select_in(
+            f"SELECT {key_column}, {', '.join(columns)} FROM {table} WHERE {key_column} IN ({{}})", keys
         )
-    """)
-    con.commit()
-    con.close()
+        return {row[0]: self._row_to_value(namespace, row[1:]) for row in rows}
+
+    def set_many(self, namespace, items, merge=False):
+        if not items:
+            return
+        table, key_column, columns, json_columns = self.TABLES[namespace]
+        rows = [
+            (key, *(json.dumps(value.get(c)) if c in json_columns and value.get(c) is not None else value.get(c)
+                    for c in columns))
+            for key, value in items.items()
+        ]
+        sql = f"INSERT INTO {table} ({key_column}, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})"
+        if merge:
+            sql += f" ON CONFLICT({key_column}) DO UPDATE SET " + ", ".join(
+                f"{c} = COALESCE(excluded.{c}, {c})" for c in columns
+            )
+        else:
+            sql = sql.replace("INSERT", "INSERT OR REPLACE", 1)
+        con = _db()
+        with con:
+            con.executemany(sql, rows)
+
+    def export(self, namespace):
+        table, key_column, columns, _ = self.TABLES[namespace]
+        # its own cursor, so a big export streams instead of loading the whole table
+        for row in _db().execute(f"SELECT {key_column}, {', '.join(columns)} FROM {table}"):
+            yield row[0], self._row_to_value(namespace, row[1:])
+
+    def clear(self, namespace):
+        con = _db()
+        with con:
+            con.execute(f"DELETE FROM {self.TABLES[namespace][0]}")
+
+
+class RedisCache(CacheBackend):
+    # one hash per key ("<prefix><namespace>:<key>"), every field JSON-encoded.
+    # a merge is just HSET of the fields we have, so it's atomic on the server
+    # and two nodes saving different fields of the same song don't clobber each
+    # other. reads and writes are pipelined CACHE_BATCH keys per round trip.
+    # if the server is unreachable the cache just misses (and the write is
+    # dropped) rather than failing the job
+    def __init__(self, url: str, prefix: str = "ap:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis but the redis package isn't installed (pip install redis)")
+        self._errors = redis.RedisError
+        self.client = redis.Redis.from_url(
+            url, socket_connect_timeout=HTTP_CONNECT_TIMEOUT, socket_timeout=HTTP_READ_TIMEOUT,
+            health_check_interval=30,
+        )
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get_many(self, namespace, keys):
+        found = {}
+        try:
+            for i in range(0, len(keys), CACHE_BATCH):
+                chunk = keys[i:i+CACHE_BATCH]
+                pipe = self.client.pipeline(transaction=False)
+                for key in chunk:
+                    pipe.hgetall(self._key(namespace, key))
+                for key, fields in zip(chunk, pipe.execute()):
+                    if fields:
+                        found[key] = {f.decode(): json.loads(v) for f, v in fields.items()}
+        except self._errors as e:
+            print(f"cache read error ({namespace}): {e}")
+            metrics.inc("cache_errors_total", op="get")
+        return found
+
+    def set_many(self, namespace, items, merge=False):
+        # replacing writes every field (None included), so there's nothing stale left to delete
+        entries = list(items.items())
+        try:
+            for i in range(0, len(entries), CACHE_BATCH):
+                pipe = self.client.pipeline(transaction=False)
+                for key, value in entries[i:i+CACHE_BATCH]:
+                    fields = {f: json.dumps(v) for f, v in value.items() if v is not None or not merge}
+                    if fields:
+                        pipe.hset(self._key(namespace, key), mapping=fields)
+                pipe.execute()
+        except self._errors as e:
+            print(f"cache write error ({namespace}): {e}")
+            metrics.inc("cache_errors_total", op="set")
+
+    def _scan(self, namespace: str):
+        # full redis keys in the namespace, CACHE_BATCH at a time
+        batch = []
+        for full_key in self.client.scan_iter(match=f"{self.prefix}{namespace}:*", count=CACHE_BATCH):
+            batch.append(full_key.decode())
+            if len(batch) >= CACHE_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def export(self, namespace):
+        start = len(self._key(namespace, ""))
+        for batch in self._scan(namespace):
+            keys = [k[start:] for k in batch]
+            yield from self.get_many(namespace, keys).items()
+
+    def clear(self, namespace):
+        for batch in self._scan(namespace):
+            self.client.delete(*batch)
+
+
+def _open_cache(url: str) -> CacheBackend:
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url)
+    if url and url != "sqlite":
+        raise RuntimeError(f"unknown CACHE_URL {url!r}, expected redis://... or sqlite")
+    return SQLiteCache()
+
+
+cache = Lazy(lambda: _open_cache(CACHE_URL))  # connecting to Redis waits for the first lookup
+
+
+def cache_export(fp):
+    # every cache namespace as JSON lines: {"ns", "key", "value"}
+    count = 0
+    for namespace in SQLiteCache.TABLES:
+        for key, value in cache.export(namespace):
+            fp.write(json.dumps({"ns": namespace, "key": key, "value": value}) + "\n")
+            count += 1
+    return count
+
+
+def cache_import(fp) -> int:
+    # loads a cache_export dump, merging into whatever is already there
+    count = 0
+    batches: dict[str, dict] = {}
+    for line in fp:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        batch = batches.setdefault(entry["ns"], {})
+        batch[entry["key"]] = entry["value"]
+        if len(batch) >= CACHE_BATCH:
+            cache.set_many(entry["ns"], batch, merge=True)
+            count += len(batch)
+            batch.clear()
+    for namespace, batch in batches.items():
+        cache.set_many(namespace, batch, merge=True)
+        count += len(batch)
+    return count
+
+
+class LRUCache:
+    # small thread-safe LRU, used to keep hot song_cache rows out of sqlite
+    # entries remember when they were stored so callers can decide what's too old
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys, keep=None) -> dict:
+        # keep(key, value, age_seconds) returning False counts the entry as a miss
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for k in keys:
+                entry = self._data.get(k)
+                if entry is None:
+                    continue
+                value, stored_at = entry
+                if keep is not None and not keep(k, value, now - stored_at):
+                    continue
+                self._data.move_to_end(k)
+                found[k] = value
+        return found
+
+    def merge_many(self, items: dict):
+        # folds non-null fields into rows we already hold, ignores rows we don't
+        with self._lock:
+            for k, v in items.items():
+                entry = self._data.get(k)
+                if entry is not None:
+                    current, stored_at = entry
+                    self._data[k] = ({**current, **{f: x for f, x in v.items() if x is not None}}, stored_at)
+
+    def put_many(self, items: dict):
+        if self.max_size <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for k, v in items.items():
+                self._data[k] = (v, now)
+                self._data.move_to_end(k)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+song_lru = LRUCache(SONG_CACHE_LRU_SIZE)
+
+
+# -------------------------------------------------------------------
+# Single-flight — popular songs show up in lots of libraries, so two jobs
+# running at once would both miss the cache and both pay for the same
+# song. whoever claims a key first does the work, anyone asking for it
+# meanwhile just waits on a Future for that answer. owners always finish
+# their own keys before waiting on anyone else's, so nobody deadlocks
+# -------------------------------------------------------------------
+
+SINGLE_FLIGHT_TIMEOUT = 300  # seconds a waiter gives the owner before treating it as a miss
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys) -> tuple[list[str], dict[str, Future]]:
+        # returns (keys this caller now has to do, {key: future} for keys someone else is doing)
+        mine, theirs = [], {}
+        with self._lock:
+            for key in keys:
+                future = self._inflight.get(key)
+                if future is None:
+                    self._inflight[key] = Future()
+                    mine.append(key)
+                else:
+                    theirs[key] = future
+        return mine, theirs
+
+    def resolve(self, results: dict):
+        # hands answers to the waiters and lets the keys go, None means "no answer"
+        with self._lock:
+            done = [(self._inflight.pop(key, None), value) for key, value in results.items()]
+        for future, value in done:
+            if future is not None:
+                future.set_result(value)
+
+    def release(self, keys):
+        # owner is finished, anything it didn't resolve comes back as None
+        self.resolve({key: None for key in keys})
+
+    @staticmethod
+    def wait(theirs: dict[str, Future]) -> dict:
+        # {key: answer} for everything that arrived in time, misses are left out
+        futures_wait(list(theirs.values()), timeout=SINGLE_FLIGHT_TIMEOUT)
+        return {
+            key: future.result() for key, future in theirs.items()
+            if future.done() and future.result() is not None
+        }
 
-_init_db()
 
-def _cache_get(track_ids: list[str]) -> dict[str, dict]:
+llm_flight = SingleFlight()     # "<track_id>:<field>" -> that field's AI answer
+artist_flight = SingleFlight()  # artist_id -> {"name", "genres"} from sp.artists
+
+def _cache_get(track_ids: list[str], wanted: dict[str, tuple[str, ...]] | None = None) -> dict[str, dict]:
     # looks up a bunch of track IDs at once and returns whatever we've saved before
+    # memory first, then the cache backend for the rest. the memory copy is
+    # per process and nobody tells it when another worker writes, so a row
+    # that's missing a field the caller wants ({key: fields}) goes back to the
+    # backend once it's a bit old. fields nobody asked for don't matter
     if not track_ids:
         return {}
-    con = sqlite3.connect(DB_PATH)
-    placeholders = ",".join("?" * len(track_ids))
-    rows = con.execute(
-        f"SELECT key, language, llm_genre FROM song_cache WHERE key IN ({placeholders})",
-        track_ids
-    ).fetchall()
-    con.close()
-    return {row[0]: {"language": row[1], "llm_genre": row[2]} for row in rows}
-
-def _cache_set(results: dict[str, dict]):
-    # saves AI results to the db
+    wanted = wanted or {}
+
+    def fresh(key: str, value: dict, age: float) -> bool:
+        return age < SONG_CACHE_PARTIAL_TTL or all(value.get(f) is not None for f in wanted.get(key, ()))
+
+    found = song_lru.get_many(track_ids, keep=fresh)
+    missing = [tid for tid in track_ids if tid not in found]
+    if missing:
+        from_db = cache.get_many("song", missing)
+        song_lru.put_many(from_db)
+        found.update(from_db)
+    return found
+
+# -------------------------------------------------------------------
+# Song identity — the same recording out as a single, an album track and a
+# deluxe edition has three track ids. answers are saved under every key a
+# song is known by (track id, ISRC, normalised title + primary artist) and
+# looked up through all of them, so any release of a song hits the cache
+# -------------------------------------------------------------------
+
+# release/edition tags that can't change a song's language or genre. a tag
+# is only dropped when it has one of these and none of _KEEP_TAG, so
+# "(Japanese Version)", "(Live Version)" or " - Acoustic Version" stay in the
+# title and get their own key
+_NOISE_TAG = re.compile(
+    r"\b(?:feat\.?|ft\.?|with|from|remaster(?:ed)?|mono|stereo|explicit|clean|radio edit|single edit|"
+    r"deluxe|bonus|edition|(?:single|album|radio|original) version)(?!\w)",
+    re.IGNORECASE,
+)
+_KEEP_TAG = re.compile(
+    r"\b(?:live|acoustic|instrumental|unplugged|remix|mix|demo|karaoke|cover|orchestral|piano|"
+    r"english|spanish|japanese|korean|chinese|mandarin|cantonese|hindi|french|german|italian|portuguese|"
+    r"russian|arabic|turkish|thai|tagalog|indonesian|vietnamese|language)\b",
+    re.IGNORECASE,
+)
+_RELEASE_TAG = re.compile(r"\s*[(\[]([^)\]]*)[)\]]|\s-\s([^-]*)$")
+
+# v2: the old "song:" keys also merged "(... Version)" releases, those rows are just left unused
+SONG_KEY_PREFIX = "song2"
+
+
+def _strip_release_tag(match: re.Match) -> str:
+    tag = match.group(1) if match.group(1) is not None else match.group(2)
+    return "" if _NOISE_TAG.search(tag) and not _KEEP_TAG.search(tag) else match.group(0)
+
+
+def _song_key(name: str, primary_artist_id: str | None) -> str | None:
+    # "song2:<artist id>:<title>" with case, character width, punctuation and edition tags folded away
+    if not primary_artist_id or not name:
+        return None
+    title = unicodedata.normalize("NFKC", _RELEASE_TAG.sub(_strip_release_tag, name) or name).casefold()
+    title = " ".join(re.sub(r"[\W_]+", " ", title).split())
+    return f"{SONG_KEY_PREFIX}:{primary_artist_id}:{title}" if title else None
+
+
+def _song_keys(track: dict) -> list[str]:
+    # every cache key a song goes by, most specific first
+    keys = [track["track_id"]]
+    if track.get("isrc"):
+        keys.append(f"isrc:{track['isrc']}")
+    song_key = track.get("song_key") or _song_key(
+        track.get("name", ""), track["artists"][0]["id"] if track.get("artists") else None
+    )
+    if song_key:
+        keys.append(song_key)
+    return keys
+
+
+def _song_id(track: dict) -> str:
+    # the broadest identity, used to ask the AI once per song rather than per release
+    return _song_keys(track)[-1]
+
+
+# the script check used to call all Cyrillic Russian, all Arabic script Arabic
+# and so on. those guesses may still sit in any cache backend (a shared Redis
+# too), so they're ignored when read and the AI gets asked instead
+_RETIRED_SCRIPT_GUESSES = frozenset({"Russian", "Arabic", "Hindi", "Bengali"})
+
+
+def _cache_lookup(
+    tracks: list[dict], need_language: set[str] = frozenset(), need_genre: set[str] = frozenset(),
+) -> dict[str, dict]:
+    # {track_id: saved answer} looked up through every key each song goes by
+    # fields come from the most specific key that has them. the need_* sets say
+    # which songs the caller wants which field for (see _cache_get)
+    keys = {t["track_id"]: _song_keys(t) for t in tracks}
+    wanted: dict[str, tuple[str, ...]] = {}
+    for tid, ks in keys.items():
+        fields = (("language",) if tid in need_language else ()) + (("llm_genre",) if tid in need_genre else ())
+        for k in ks:
+            wanted[k] = tuple(dict.fromkeys(wanted.get(k, ()) + fields))
+    rows = _cache_get(list({k for ks in keys.values() for k in ks}), wanted)
+    found = {}
+    for tid, ks in keys.items():
+        entry = {}
+        for k in ks:
+            row = rows.get(k)
+            if not row:
+                continue
+            if row.get("language_source") == "script" and row.get("language") in _RETIRED_SCRIPT_GUESSES:
+                row = {**row, "language": None}
+            if row.get("language") and not entry.get("language"):
+                entry["language"], entry["language_source"] = row["language"], row.get("language_source")
+            if row.get("llm_genre") and not entry.get("llm_genre"):
+                entry["llm_genre"] = row["llm_genre"]
+        if entry:
+            found[tid] = entry
+    metrics.inc("song_cache_lookups_total", len(found), result="hit")
+    metrics.inc("song_cache_lookups_total", len(keys) - len(found), result="miss")
+    return found
+
+
+def _cache_set(results: dict[str, dict], tracks: dict[str, dict] | None = None):
+    # saves AI (or local) results to the db
+    # with `tracks` ({track_id: track}) each answer is saved under all of the song's keys
     # important: we skip saving if both fields are null — don't want to permanently
     # cache a failed API call as "Unknown" forever
+    # a null field never overwrites one we already have, so a genre-only answer
+    # doesn't wipe a language we saved earlier
     if not results:
         return
-    rows = [
-        (tid, v.get("language"), v.get("llm_genre"))
+    # (language_source goes with language, it's only written when language is)
+    rows = {
+        key: {
+            "language": v.get("language"),
+            "llm_genre": v.get("llm_genre"),
+            "language_source": (v.get("language_source") or "llm") if v.get("language") else None,
+        }
         for tid, v in results.items()
         if v.get("language") or v.get("llm_genre")
-    ]
+        for key in (_song_keys(tracks[tid]) if tracks and tid in tracks else [tid])
+    }
     if not rows:
         return
-    con = sqlite3.connect(DB_PATH)
-    con.executemany(
-        "INSERT OR REPLACE INTO song_cache (key, language, llm_genre) VALUES (?, ?, ?)",
-        rows
-    )
-    con.commit()
-    con.close()
+    cache.set_many("song", rows, merge=True)
+    song_lru.merge_many(rows)
+
+def _merge_llm(into: dict[str, dict], results: dict[str, dict]):
+    # same rule as _cache_set but for the in-memory dict the pipeline works from
+    for tid, v in results.items():
+        current = into.get(tid) or {}
+        into[tid] = {**current, **{f: x for f, x in v.items() if x is not None}}
+
+
+# artist genres basically never change, so we keep them for a while
+# rows older than the TTL are refetched, but still used if Spotify is down
+ARTIST_CACHE_TTL_DAYS = float(os.getenv("ARTIST_CACHE_TTL_DAYS", "30"))
+
+def _artist_cache_get(artist_ids: list[str]) -> dict[str, dict]:
+    # returns {artist_id: {"name", "genres", "fresh"}} for everything we have saved
+    if not artist_ids:
+        return {}
+    cutoff = time.time() - ARTIST_CACHE_TTL_DAYS * 86400
+    return {
+        aid: {"name": a.get("name"), "genres": a.get("genres") or [], "fresh": (a.get("fetched_at") or 0) >= cutoff}
+        for aid, a in cache.get_many("artist", artist_ids).items()
+    }
+
+def _artist_cache_set(artists: dict[str, dict]):
+    # artists is {artist_id: {"name", "genres"}} straight from Spotify
+    # an empty genre list is still worth saving, it means Spotify has nothing
+    if not artists:
+        return
+    now = time.time()
+    cache.set_many("artist", {
+        aid: {"name": a.get("name"), "genres": a.get("genres", []), "fetched_at": now}
+        for aid, a in artists.items()
+    })
+
+
+# artist-level guesses (see _artist_consensus), keyed by artist id
+def _artist_inference_get(artist_ids: list[str]) -> dict[str, dict]:
+    if not artist_ids:
+        return {}
+    return {
+        aid: {
+            "language": v.get("language") if v.get("language_source") == "llm" else None,
+            "llm_genre": v.get("llm_genre"),
+        }
+        for aid, v in cache.get_many("artist_inference", artist_ids).items()
+    }
+
+def _artist_inference_set(inference: dict[str, dict]):
+    # only fields we're sure about are written, the others keep whatever was there
+    if not inference:
+        return
+    now = time.time()
+    cache.set_many("artist_inference", {
+        aid: {
+            "language": v.get("language"), "language_votes": v.get("language_votes"),
+            "language_source": "llm" if v.get("language") else None,
+            "llm_genre": v.get("llm_genre"), "genre_votes": v.get("genre_votes"), "updated_at": now,
+        }
+        for aid, v in inference.items()
+    }, merge=True)
+
+
+# playlist contents, as Library columns (see Library.to_json)
+# bump TRACK_FORMAT_VERSION whenever _format_track or Library changes shape so old rows get ignored
+TRACK_FORMAT_VERSION = 4
+
+def _playlist_cache_get(key: str) -> dict | None:
+    row = cache.get_many("playlist", [key]).get(key)
+    if not row or row.get("format") != TRACK_FORMAT_VERSION:
+        return None
+    row["tracks"] = Library.from_json(row["tracks"])
+    return row
+
+def _playlist_cache_set(key: str, snapshot_id: str | None, total: int, tracks: "Library", fetched_at: float | None = None):
+    cache.set_many("playlist", {key: {
+        "snapshot_id": snapshot_id, "total": total, "format": TRACK_FORMAT_VERSION,
+        "tracks": tracks.to_json(), "fetched_at": fetched_at or time.time(),
+    }})
+
+
+# the last run's track ids and group buckets, see _process_tracks step 2
+# the signature covers everything that decides which groups a track lands in,
+# a state saved under a different one is ignored. after
+# GENERATION_FULL_REFRESH_DAYS the whole library is processed again anyway,
+# so artist genres that changed on Spotify make it in eventually
+GENERATION_FULL_REFRESH_DAYS = float(os.getenv("GENERATION_FULL_REFRESH_DAYS", "7"))
+GENERATION_STATE_FORMAT = 3  # bump when the stored state changes shape, or when old groupings are wrong
+
+def _generation_state_get(key: str, signature: str) -> dict | None:
+    row = cache.get_many("generation", [key]).get(key)
+    if not row or row.get("signature") != signature or time.time() - row["created_at"] > GENERATION_FULL_REFRESH_DAYS * 86400:
+        return None
+    state = row["state"]
+    state["created_at"] = row["created_at"]
+    return state
+
+def _generation_state_set(key: str, signature: str, state: dict, created_at: float | None = None):
+    now = time.time()
+    cache.set_many("generation", {key: {
+        "signature": signature, "state": state, "created_at": created_at or now, "updated_at": now,
+    }})
+
+
+# -------------------------------------------------------------------
+# Local language guess — a song titled in Hangul is Korean, we don't need
+# an LLM for that. we look at which Unicode scripts the title, album and
+# artist names are written in (title counts the most, artists the least,
+# since a Korean artist can still sing in English). if one non-Latin
+# script clearly wins and only one language is written in it, we take that
+# language, otherwise it goes to Groq. the confidence only says how much of
+# the text is in that script, not which language it is — so Cyrillic,
+# Arabic-script, Devanagari and Bengali (Russian/Bulgarian/Belarusian,
+# Arabic/Persian, Hindi/Marathi/Nepali...) are only settled here when a
+# letter only one of those languages uses shows up.
+# Latin-script songs always go to Groq — English, Spanish and French all
+# look the same here. Han-only text (no kana) also goes to Groq, because
+# it could be Chinese or Japanese
+# -------------------------------------------------------------------
+
+LOCAL_LANGUAGE_CONFIDENCE = float(os.getenv("LOCAL_LANGUAGE_CONFIDENCE", "0.6"))
+
+# (start, end, script) — sorted by start so we can bisect
+_SCRIPT_RANGES = sorted([
+    (0x0370, 0x03FF, "greek"),
+    (0x0400, 0x052F, "cyrillic"),
+    (0x0590, 0x05FF, "hebrew"),
+    (0x0600, 0x06FF, "arabic"),
+    (0x0750, 0x077F, "arabic"),
+    (0x0900, 0x097F, "devanagari"),
+    (0x0980, 0x09FF, "bengali"),
+    (0x0A00, 0x0A7F, "gurmukhi"),
+    (0x0A80, 0x0AFF, "gujarati"),
+    (0x0B80, 0x0BFF, "tamil"),
+    (0x0C00, 0x0C7F, "telugu"),
+    (0x0C80, 0x0CFF, "kannada"),
+    (0x0D00, 0x0D7F, "malayalam"),
+    (0x0E00, 0x0E7F, "thai"),
+    (0x1100, 0x11FF, "hangul"),
+    (0x3040, 0x30FF, "kana"),
+    (0x3130, 0x318F, "hangul"),
+    (0x31F0, 0x31FF, "kana"),
+    (0x3400, 0x4DBF, "han"),
+    (0x4E00, 0x9FFF, "han"),
+    (0xAC00, 0xD7AF, "hangul"),
+    (0xF900, 0xFAFF, "han"),
+    (0xFF66, 0xFF9F, "kana"),
+])
+_SCRIPT_STARTS = [r[0] for r in _SCRIPT_RANGES]
+
+# None = several languages share the script, only _LANGUAGE_HINTS can settle it
+_SCRIPT_LANGUAGE = {
+    "greek": "Greek", "cyrillic": None, "hebrew": "Hebrew", "arabic": None,
+    "devanagari": None, "bengali": None, "gurmukhi": "Punjabi", "gujarati": "Gujarati",
+    "tamil": "Tamil", "telugu": "Telugu", "kannada": "Kannada", "malayalam": "Malayalam",
+    "thai": "Thai", "hangul": "Korean", "kana": "Japanese",
+}
+
+# letters that only some languages sharing a script use, checked in order
+# None means the letters are shared by several languages (Kazakh, Uzbek and
+# Tajik all use қ ғ, Macedonian has ј љ њ like Serbian), so it's left to the AI
+_LANGUAGE_HINTS = {
+    "cyrillic": [
+        ("әғқңөұүһҗҷҳӣӯ", None),      # Kazakh, Uzbek, Tatar, Kyrgyz, Tajik...
+        ("ў", "Belarusian"),          # before і, which Belarusian shares with Ukrainian
+        ("їєґ", "Ukrainian"),
+        ("ѓќѕ", "Macedonian"),
+        ("ђћ", "Serbian"),
+    ],
+    "arabic": [
+        ("ٹڈڑںےۓھہ", "Urdu"),           # before ی/ک, which Urdu shares with Persian
+        ("ڵڕۆێەټډړښږځڅګڼٽڊڏٻڄڃ", None),  # Kurdish, Pashto, Sindhi
+        ("یکپچژگ", "Persian"),
+    ],
+}
+
+def _char_script(ch: str) -> str | None:
+    # None means Latin or anything else we don't special-case
+    cp = ord(ch)
+    i = bisect.bisect_right(_SCRIPT_STARTS, cp) - 1
+    if i >= 0 and cp <= _SCRIPT_RANGES[i][1]:
+        return _SCRIPT_RANGES[i][2]
+    return None
+
+def _detect_script_language(track: dict) -> str | None:
+    # returns a language if we're confident enough, otherwise None (ask the AI)
+    # each field scores the share of its letters in each script, then the fields
+    # are averaged by weight — share, not letter count, because "봄날" is two
+    # letters and still says more than a long English album name
+    fields = [
+        (track["name"], 1.0),
+        (track.get("album") or "", 0.3),
+        (" ".join(a["name"] for a in track["artists"]), 0.2),
+    ]
+    counts = []
+    for text, weight in fields:
+        field: dict[str | None, int] = {}
+        for ch in text:
+            if ch.isalpha():
+                script = _char_script(ch)
+                field[script] = field.get(script, 0) + 1
+        if field:
+            counts.append((field, weight))
+    if not counts:
+        return None
+
+    # kanji next to any kana is Japanese
+    if any("kana" in field for field, _ in counts):
+        for field, _ in counts:
+            if "han" in field:
+                field["kana"] = field.get("kana", 0) + field.pop("han")
+
+    total_weight = sum(weight for _, weight in counts)
+    scores: dict[str, float] = {}
+    for field, weight in counts:
+        letters = sum(field.values())
+        for script, n in field.items():
+            if script in _SCRIPT_LANGUAGE:
+                scores[script] = scores.get(script, 0.0) + weight * n / letters
+    if not scores:
+        return None
+    script = max(scores, key=scores.get)
+    if scores[script] / total_weight < LOCAL_LANGUAGE_CONFIDENCE:
+        return None
+
+    all_text = " ".join(text for text, _ in fields).lower()
+    for letters, language in _LANGUAGE_HINTS.get(script, ()):
+        if any(ch in all_text for ch in letters):
+            return language  # None here means "could be either", ask the AI
+    return _SCRIPT_LANGUAGE[script]
+
+
+# -------------------------------------------------------------------
+# Groq rate limits — the free tier caps requests and tokens per minute
+# we keep our own rolling one-minute window and also trust whatever
+# Groq tells us in the x-ratelimit-* response headers, so batches can run
+# in parallel without blowing through the budget and eating 429s
+# -------------------------------------------------------------------
+
+GROQ_CONCURRENCY = int(os.getenv("GROQ_CONCURRENCY", "4"))
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+GROQ_MAX_ATTEMPTS = int(os.getenv("GROQ_MAX_ATTEMPTS", "4"))
+
+
+def _parse_duration(value) -> float | None:
+    # groq sends reset times like "2m59.56s", "7.66s" or "120ms"
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", str(value))
+    if not parts:
+        try:
+            return float(value)  # retry-after is just plain seconds
+        except ValueError:
+            return None
+    return sum(float(num) * units[unit] for num, unit in parts)
+
+
+class GroqBudget:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._cond = threading.Condition()
+        self._sent: deque[float] = deque()                # when each request in the last minute went out
+        self._spent: deque[tuple[float, int]] = deque()   # (when, estimated tokens) for the last minute
+        self._remaining_requests: int | None = None       # from headers, None until we've seen one
+        self._remaining_tokens: int | None = None
+        self._requests_reset_at = 0.0
+        self._tokens_reset_at = 0.0
+        self._paused_until = 0.0                          # set after a 429
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        while self._sent and now - self._sent[0] >= 60:
+            self._sent.popleft()
+        while self._spent and now - self._spent[0][0] >= 60:
+            self._spent.popleft()
+
+        waits = [self._paused_until - now]
+        if len(self._sent) >= self.rpm:
+            waits.append(self._sent[0] + 60 - now)
+        # a single huge batch is still allowed through on an empty window
+        if self._spent and sum(t for _, t in self._spent) + tokens > self.tpm:
+            waits.append(self._spent[0][0] + 60 - now)
+        if self._remaining_requests is not None and self._remaining_requests <= 0:
+            waits.append(self._requests_reset_at - now)
+        if self._remaining_tokens is not None and self._remaining_tokens < tokens:
+            waits.append(self._tokens_reset_at - now)
+        return max(waits)
+
+    def acquire(self, tokens: int):
+        # blocks until there's room in the budget, then reserves it
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+            self._sent.append(now)
+            self._spent.append((now, tokens))
+            if self._remaining_requests is not None:
+                self._remaining_requests -= 1
+            if self._remaining_tokens is not None:
+                self._remaining_tokens -= tokens
+
+    def update(self, headers):
+        # whatever Groq says is the real budget, overrides our guesses
+        if not headers:
+            return
+        now = time.monotonic()
+        with self._cond:
+            if headers.get("x-ratelimit-remaining-requests") is not None:
+                self._remaining_requests = int(float(headers["x-ratelimit-remaining-requests"]))
+                self._requests_reset_at = now + (_parse_duration(headers.get("x-ratelimit-reset-requests")) or 0)
+            if headers.get("x-ratelimit-remaining-tokens") is not None:
+                self._remaining_tokens = int(float(headers["x-ratelimit-remaining-tokens"]))
+                self._tokens_reset_at = now + (_parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        # after a 429 nobody sends anything until retry-after has passed
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+groq_budget = GroqBudget(GROQ_RPM, GROQ_TPM)
+
+
+# -------------------------------------------------------------------
+# Circuit breaker — when Groq is down every batch used to burn through its
+# retries and back-offs inside /generate. after GROQ_BREAKER_FAILURES
+# failed calls in a row we stop calling it for a while (open), then let a
+# single call through to test the water (half-open). each failed test
+# doubles the wait, up to GROQ_BREAKER_MAX_SECONDS
+# -------------------------------------------------------------------
+
+GROQ_BREAKER_FAILURES = int(os.getenv("GROQ_BREAKER_FAILURES", "5"))
+GROQ_BREAKER_SECONDS = float(os.getenv("GROQ_BREAKER_SECONDS", "60"))
+GROQ_BREAKER_MAX_SECONDS = 600
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown: float, max_cooldown: float):
+        self.failure_limit = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._cooldown = cooldown
+        self._open_until = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() >= self._open_until:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def blocked(self) -> bool:
+        # open and still cooling down — peeks without taking the half-open trial
+        with self._lock:
+            return self.state == "open" and time.monotonic() < self._open_until
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+            self._trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half-open":
+                self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+            if self.state == "half-open" or self._failures >= self.failure_limit:
+                if self.state != "open":
+                    print(f"groq circuit open for {self._cooldown:.0f}s")
+                self.state = "open"
+                self._open_until = time.monotonic() + self._cooldown
+            self._trial_running = False
+
+
+groq_breaker = CircuitBreaker(GROQ_BREAKER_FAILURES, GROQ_BREAKER_SECONDS, GROQ_BREAKER_MAX_SECONDS)
+
+
+# -------------------------------------------------------------------
+# Adaptive batch size — instead of a fixed 25 songs per call, we grow the
+# batch a bit every time an answer comes back comfortably under max_tokens
+# and halve it whenever one gets cut off. shared by every job, since it's
+# really a property of the model, not of one library
+# -------------------------------------------------------------------
+
+GROQ_MAX_TOKENS = 4096
+GROQ_BATCH_START = int(os.getenv("GROQ_BATCH_START", "25"))
+GROQ_BATCH_MIN = int(os.getenv("GROQ_BATCH_MIN", "5"))
+GROQ_BATCH_MAX = int(os.getenv("GROQ_BATCH_MAX", "60"))
+GROQ_REQUEUE_LIMIT = 2
+
+
+class BatchSizer:
+    def __init__(self, start: int, low: int, high: int, step: int = 5):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.size = max(low, min(high, start))
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        with self._lock:
+            return self.size
+
+    def fitted(self, completion_tokens: int):
+        # plenty of room left in the answer -> try a few more songs next time
+        with self._lock:
+            if completion_tokens < 0.6 * GROQ_MAX_TOKENS:
+                self.size = min(self.high, self.size + self.step)
+
+    def truncated(self, fitted: int):
+        # drop to a bit under what actually fit (or halve if nothing did) —
+        # several batches in flight can come back cut off at once, and they
+        # shouldn't each halve it again
+        target = int(fitted * 0.8) if fitted else self.size // 2
+        with self._lock:
+            self.size = max(self.low, min(self.size, target))
+
+
+groq_batch_size = BatchSizer(GROQ_BATCH_START, GROQ_BATCH_MIN, GROQ_BATCH_MAX)
+
+
+def _run_groq_queue(
+    tracks: list[dict],
+    existing_genres: set[str],
+    need_language: set[str],
+    need_genre: set[str],
+    on_result,
+    progress: "Progress | None" = None,
+):
+    # sends every track to _call_groq_batch, up to GROQ_CONCURRENCY calls at a time
+    # each free worker takes the next groq_batch_size.current() songs off the queue,
+    # so the size follows what the model has been coping with. songs a cut-off
+    # answer didn't get to go back in the queue (up to GROQ_REQUEUE_LIMIT times).
+    # on_result(results) gets each batch's results as soon as that batch finishes
+    if not tracks:
+        return
+    queue = deque(tracks)
+    requeued: dict[str, int] = {}
+    queue_lock = threading.Lock()
+    result_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with queue_lock:
+                n = groq_batch_size.current()
+                batch = [queue.popleft() for _ in range(min(n, len(queue)))]
+            if not batch:
+                return
+            if progress:
+                progress.add("llm_batches_total")
+            results = _call_groq_batch(
+                tracks=batch,
+                existing_genres=existing_genres,
+                need_language=any(t["track_id"] in need_language for t in batch),
+                need_genre=any(t["track_id"] in need_genre for t in batch),
+            )
+            if results:
+                with queue_lock:
+                    for t in batch:
+                        tid = t["track_id"]
+                        if tid not in results and requeued.get(tid, 0) < GROQ_REQUEUE_LIMIT:
+                            requeued[tid] = requeued.get(tid, 0) + 1
+                            queue.append(t)
+            with result_lock:
+                on_result(results)
+                if progress:
+                    progress.add("llm_batches_done")
+
+    workers = min(GROQ_CONCURRENCY, -(-len(tracks) // groq_batch_size.current()))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for future in [pool.submit(worker) for _ in range(max(1, workers))]:
+            future.result()
+
+
+# -------------------------------------------------------------------
+# Tolerant JSON — when the answer gets cut off at max_tokens (or the model
+# adds chatter around it) json.loads fails on the whole thing, and we used
+# to throw away every song in the batch. this pulls out every complete
+# {...} object instead, so only the songs after the cut are lost
+# -------------------------------------------------------------------
+
+_json_decoder = json.JSONDecoder()
+
+def _parse_json_objects(raw: str) -> list[dict]:
+    # every object in the answer, whether it came back as one clean array or not
+    raw = raw.strip()
+    # sometimes the model wraps the response in ```json ``` even though we said not to
+    raw = re.sub(r"^```(?:json)?", "", raw).strip()
+    raw = re.sub(r"```$", "", raw).strip()
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, list):
+            return [p for p in parsed if isinstance(p, dict)]
+    except ValueError:
+        pass
+
+    objects = []
+    i = 0
+    while True:
+        start = raw.find("{", i)
+        if start < 0:
+            break
+        try:
+            obj, end = _json_decoder.raw_decode(raw, start)
+        except ValueError:
+            i = start + 1  # broken or cut-off object, look for the next one
+            continue
+        if isinstance(obj, dict):
+            objects.append(obj)
+        i = end
+    return objects
 
 
 # -------------------------------------------------------------------
 # AI batch call — sends songs to Groq and gets back language/genre
-# we batch 25 songs per request because Llama cuts off if we send too many
-# the prompt asks for a raw JSON array so we can parse it directly
+# the prompt asks for a raw JSON array with short keys ("n", "l", "g") and
+# the song's number in every object, so answers still line up with the
+# right song when some of them get lost
 # -------------------------------------------------------------------
 
+# bits of titles that cost tokens but don't help with language or genre
+_TITLE_NOISE = re.compile(
+    r"\s*(?:[(\[](?:feat\.?|ft\.?|with|from|remaster(?:ed)?|\d{4} remaster)[^)\]]*[)\]]"
+    r"|-\s*(?:\d{4}\s+)?remaster(?:ed)?(?:\s+\d{4})?(?:\s+version)?\s*$)",
+    re.IGNORECASE,
+)
+PROMPT_MAX_ARTISTS = 2
+
+
+def _compact_title(name: str) -> str:
+    return _TITLE_NOISE.sub("", name).strip() or name
+
+
 def _call_groq_batch(
     tracks: list[dict],
     existing_genres: set[str],
@@ -126,64 +1504,234 @@ def _call_groq_batch(
     if not tracks:
         return {}
 
-    # build the numbered song list for the prompt
+    # build the numbered song list for the prompt, two artists is plenty
     lines = []
     for i, t in enumerate(tracks, 1):
-        artist_str = ", ".join(a["name"] for a in t["artists"])
-        lines.append(f"{i}. {t['name']} — {artist_str}")
+        artist_str = ", ".join(a["name"] for a in t["artists"][:PROMPT_MAX_ARTISTS])
+        lines.append(f"{i}. {_compact_title(t['name'])} — {artist_str}")
 
     # figure out what we actually need from the AI for this batch
-    fields = []
+    fields = ['"n": <song number>']
+    notes = []
     if need_language:
-        fields.append('"language": "<language name in English, e.g. English, Japanese, Hindi, Korean>"')
+        fields.append('"l": "<language in English, e.g. English, Japanese, Hindi>"')
     if need_genre:
-        genre_hint = ""
+        fields.append('"g": "<single most fitting genre>"')
         if existing_genres:
             # give it a hint of genres we already have so it tries to match
-            # instead of making up completely new ones
+            # instead of making up completely new ones — said once, not per field
             sample = sorted(existing_genres)[:20]
-            genre_hint = f' Prefer matching from this existing list if accurate: {json.dumps(sample)}. If none fit well, suggest a concise new genre name.'
-        fields.append(f'"genre": "<single most fitting music genre>"{genre_hint}')
-
-    field_str = ", ".join(fields)
-
-    prompt = f"""You are a music analyst. For each song below, return ONLY a JSON array.
-Each element must be an object with exactly these fields: {field_str}
-One object per song, in the same order. No explanation, no markdown, just the raw JSON array.
+            notes.append(f"For g, prefer one of {json.dumps(sample)} if accurate, else a concise new genre.")
 
+    prompt = f"""Music analyst. Return ONLY a raw JSON array, one object per song: {{{", ".join(fields)}}}
+{" ".join(notes)}
 Songs:
 {chr(10).join(lines)}"""
 
-    try:
-        response = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,  # low temp = more consistent, less random
-            max_tokens=4096,
-        )
-        raw = response.choices[0].message.content.strip()
-        # sometimes the model wraps the response in ```json ``` even though we said not to
-        raw = re.sub(r"^```(?:json)?", "", raw).strip()
-        raw = re.sub(r"```$", "", raw).strip()
-        parsed = json.loads(raw)
-    except Exception as e:
-        print(f"groq error: {e}")
+    # rough token guess for the budget: ~4 chars per token for the prompt,
+    # plus roughly 15 tokens of JSON back per song
+    est_tokens = len(prompt) // 4 + 15 * len(tracks)
+
+    # groq looks down — fail fast, the songs go to the retry queue instead
+    if not groq_breaker.allow():
+        metrics.inc("groq_batches_total", outcome="skipped")
         return {}
 
-    # map results back to track IDs
-    results = {}
-    for i, t in enumerate(tracks):
-        if i >= len(parsed):
+    response = None
+    for attempt in range(GROQ_MAX_ATTEMPTS):
+        groq_budget.acquire(est_tokens)
+        started = time.monotonic()
+        try:
+            raw_response = groq_client.chat.completions.with_raw_response.create(
+                model="llama-3.1-8b-instant",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,  # low temp = more consistent, less random
+                max_tokens=GROQ_MAX_TOKENS,
+            )
+            groq_budget.update(raw_response.headers)
+            response = raw_response.parse()
+            metrics.observe("groq_request_seconds", time.monotonic() - started)
             break
-        entry = parsed[i]
+        except groq.RateLimitError as e:
+            # 429 — pause everyone until groq says it's fine again
+            metrics.inc("groq_rate_limited_total")
+            groq_budget.update(e.response.headers)
+            wait = _parse_duration(e.response.headers.get("retry-after")) or 2 ** attempt
+            groq_budget.pause(wait)
+        except (groq.APIConnectionError, groq.InternalServerError) as e:
+            print(f"groq error (attempt {attempt + 1}): {e}")
+            time.sleep(2 ** attempt)
+        except Exception as e:
+            print(f"groq error: {e}")
+            groq_breaker.failure()
+            metrics.inc("groq_batches_total", outcome="failed")
+            return {}
+
+    if response is None:
+        print(f"groq error: gave up after {GROQ_MAX_ATTEMPTS} attempts")
+        groq_breaker.failure()
+        metrics.inc("groq_batches_total", outcome="failed")
+        return {}
+    groq_breaker.success()
+    if response.usage:
+        metrics.inc("groq_tokens_total", response.usage.prompt_tokens, kind="prompt")
+        metrics.inc("groq_tokens_total", response.usage.completion_tokens, kind="completion")
+
+    choice = response.choices[0]
+    parsed = _parse_json_objects(choice.message.content or "")
+    # only a cut-off (or an answer missing songs) means the batch was too big.
+    # a complete answer with some chatter around the JSON is still a fit
+    truncated = choice.finish_reason == "length" or len(parsed) < len(tracks)
+    metrics.inc("groq_batches_total", outcome="truncated" if truncated else "ok")
+    if truncated:
+        groq_batch_size.truncated(len(parsed))
+        print(f"groq: salvaged {len(parsed)}/{len(tracks)} songs from a cut-off or messy answer")
+    elif response.usage:
+        groq_batch_size.fitted(response.usage.completion_tokens)
+
+    # map results back to track IDs — by the "n" the model echoed back when it did,
+    # by position otherwise
+    by_number: dict[int, dict] = {}
+    for i, entry in enumerate(parsed):
+        n = entry.get("n")
+        if isinstance(n, str) and n.isdigit():
+            n = int(n)
+        if not isinstance(n, int):
+            n = i + 1
+        if 1 <= n <= len(tracks):
+            by_number.setdefault(n, entry)
+
+    results = {}
+    for n, entry in by_number.items():
+        t = tracks[n - 1]
+        language = (entry.get("l") or entry.get("language")) if need_language else None
+        genre = (entry.get("g") or entry.get("genre")) if need_genre else None
+        if not isinstance(language, str):
+            language = None
+        if not isinstance(genre, str):
+            genre = None
         results[t["track_id"]] = {
-            "language": entry.get("language") if need_language else None,
-            "llm_genre": entry.get("genre") if need_genre else None,
+            "language": language,
+            "llm_genre": genre,
+            "language_source": "llm" if language else None,
         }
 
+    metrics.inc("groq_songs_total", len(tracks), kind="sent")
+    metrics.inc("groq_songs_total", len(results), kind="answered")
     return results
 
 
+# -------------------------------------------------------------------
+# Retry queue — songs the AI failed on go into llm_pending with an attempt
+# count and a next_attempt_at that backs off exponentially. a background
+# thread (_pending_worker) drains it, so /generate never waits on retries,
+# and songs already waiting there are left out of /generate's own AI calls
+# -------------------------------------------------------------------
+
+LLM_RETRY_INTERVAL = float(os.getenv("LLM_RETRY_INTERVAL", "30"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "60"))
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "8"))
+LLM_RETRY_BATCH = 200
+LLM_RETRY_LEASE_SECONDS = 600  # so two workers (or processes) don't grab the same rows
+
+_pending_stop = threading.Event()
+
+
+def _pending_add(tracks: list[dict], need_language: set[str], need_genre: set[str], error: str):
+    # records failed songs, or bumps their attempt count if they were already waiting
+    if not tracks:
+        return
+    now = time.time()
+    con = _db()
+    with con:
+        attempts = dict(_select_in(
+            "SELECT track_id, attempts FROM llm_pending WHERE track_id IN ({})",
+            [t["track_id"] for t in tracks]
+        ))
+        rows, dropped = [], []
+        for t in tracks:
+            tid = t["track_id"]
+            n = attempts.get(tid, 0) + 1
+            if n > LLM_RETRY_MAX_ATTEMPTS:
+                dropped.append((tid,))  # give up, the next /generate can try again
+                continue
+            rows.append((
+                tid, json.dumps(t), int(tid in need_language), int(tid in need_genre),
+                n, now + LLM_RETRY_BASE_SECONDS * 2 ** (n - 1), error,
+            ))
+        con.executemany(
+            "INSERT OR REPLACE INTO llm_pending (track_id, track, need_language, need_genre, attempts, next_attempt_at, last_error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        con.executemany("DELETE FROM llm_pending WHERE track_id = ?", dropped)
+
+
+def _pending_ids(track_ids: list[str]) -> set[str]:
+    # which of these songs the background worker already owns
+    if not track_ids:
+        return set()
+    return {row[0] for row in _select_in("SELECT track_id FROM llm_pending WHERE track_id IN ({})", track_ids)}
+
+
+def _pending_claim(limit: int) -> list[tuple]:
+    # takes up to `limit` due rows and pushes their next_attempt_at out by a lease.
+    # BEGIN IMMEDIATE takes the write lock before the SELECT (sqlite3 would only
+    # open the transaction at the UPDATE), so every uvicorn worker draining on
+    # the same schedule waits its turn and then only sees rows nobody leased
+    now = time.time()
+    con = _db()
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        rows = con.execute(
+            "SELECT track_id, track, need_language, need_genre FROM llm_pending WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        con.executemany(
+            "UPDATE llm_pending SET next_attempt_at = ? WHERE track_id = ?",
+            [(now + LLM_RETRY_LEASE_SECONDS, r[0]) for r in rows]
+        )
+    return rows
+
+
+def _pending_drain_once() -> int:
+    # one pass over whatever is due, returns how many songs got classified
+    if groq_breaker.blocked():
+        return 0
+    rows = _pending_claim(LLM_RETRY_BATCH)
+    if not rows:
+        return 0
+    tracks = [json.loads(r[1]) for r in rows]
+    need_language = {r[0] for r in rows if r[2]}
+    need_genre = {r[0] for r in rows if r[3]}
+    done: set[str] = set()
+
+    by_id = {t["track_id"]: t for t in tracks}
+
+    def on_result(results: dict[str, dict]):
+        _cache_set(results, by_id)
+        for tid, v in results.items():
+            if (tid not in need_language or v.get("language")) and (tid not in need_genre or v.get("llm_genre")):
+                done.add(tid)
+
+    _run_groq_queue(tracks, set(), need_language, need_genre, on_result)
+
+    con = _db()
+    with con:
+        con.executemany("DELETE FROM llm_pending WHERE track_id = ?", [(tid,) for tid in done])
+    failed = [t for t in tracks if t["track_id"] not in done]
+    _pending_add(failed, need_language, need_genre, "retry failed")
+    return len(done)
+
+
+def _pending_worker():
+    # background thread started on app startup
+    while not _pending_stop.wait(LLM_RETRY_INTERVAL):
+        try:
+            _pending_drain_once()
+        except Exception as e:
+            print(f"retry queue error: {e}")
+
+
 # -------------------------------------------------------------------
 # Genre normaliser — Spotify gives very specific genre tags like
 # "korean pop", "k-pop", "k pop" which are all the same thing.
@@ -204,14 +1752,78 @@ GENRE_MAP = [
     (["country", "folk", "americana", "bluegrass", "singer-songwriter"], "Country / Folk"),
 ]
 
+# each bucket's keyword list gets compiled into one regex, so a genre is at most
+# one C-level scan per bucket instead of ~100 substring checks, and every distinct
+# raw genre is only worked out once. buckets are still tried in order, so the
+# first bucket wins exactly like the old any(k in g) loop.
+# GENRE_MAP can also come from a JSON file (GENRE_MAP_PATH):
+#   [{"bucket": "K-Pop", "keywords": ["k-pop", "korean pop"]}, ...]
+# the file is re-read whenever it changes, no restart needed
+GENRE_MAP_PATH = os.getenv("GENRE_MAP_PATH", os.path.join(os.path.dirname(__file__), "genre_map.json"))
+GENRE_MAP_CHECK_SECONDS = 30
+
+
+class GenreIndex:
+    def __init__(self, genre_map: list[tuple[list[str], str]]):
+        self.patterns = [
+            (re.compile("|".join(re.escape(k.lower()) for k in keywords)), bucket)
+            for keywords, bucket in genre_map if keywords
+        ]
+        # changes whenever the map does, so saved groupings built with an old map get redone
+        self.signature = hashlib.sha1(json.dumps(genre_map).encode()).hexdigest()[:12]
+        self.normalise = functools.lru_cache(maxsize=65536)(self._normalise)
+
+    def _normalise(self, genre: str) -> str:
+        g = genre.lower().strip()
+        for pattern, bucket in self.patterns:
+            if pattern.search(g):
+                return bucket
+        return genre.title()
+
+
+def _load_genre_map(path: str) -> list[tuple[list[str], str]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [(list(entry["keywords"]), entry["bucket"]) for entry in data]
+
+
+_genre_index = GenreIndex(GENRE_MAP)
+_genre_index_mtime: float | None = None
+_genre_index_checked = 0.0
+_genre_index_lock = threading.Lock()
+
+
+def _current_genre_index() -> GenreIndex:
+    # returns the compiled index, rebuilding it if the config file changed
+    # (only looks at the file every GENRE_MAP_CHECK_SECONDS)
+    global _genre_index, _genre_index_mtime, _genre_index_checked
+    now = time.monotonic()
+    if now - _genre_index_checked < GENRE_MAP_CHECK_SECONDS:
+        return _genre_index
+    with _genre_index_lock:
+        if now - _genre_index_checked < GENRE_MAP_CHECK_SECONDS:
+            return _genre_index
+        _genre_index_checked = now
+        try:
+            mtime = os.path.getmtime(GENRE_MAP_PATH)
+        except OSError:
+            mtime = None
+        if mtime != _genre_index_mtime:
+            try:
+                genre_map = _load_genre_map(GENRE_MAP_PATH) if mtime is not None else GENRE_MAP
+                _genre_index = GenreIndex(genre_map)
+                _genre_index_mtime = mtime
+            except Exception as e:
+                # a broken file shouldn't take genres down, keep the last good index
+                print(f"genre map error ({GENRE_MAP_PATH}): {e}")
+                _genre_index_mtime = mtime
+    return _genre_index
+
+
 def _normalise_genre(genre: str) -> str:
     # checks if the raw genre string matches any of our keyword lists
     # returns the clean bucket name if found, otherwise just title-cases the original
-    g = genre.lower().strip()
-    for keywords, bucket in GENRE_MAP:
-        if any(k in g for k in keywords):
-            return bucket
-    return genre.title()
+    return _current_genre_index().normalise(genre)
 
 
 # pulls the access token out of the Authorization header and returns a Spotify client
@@ -220,7 +1832,73 @@ def get_spotify_client(authorization: str) -> spotipy.Spotify:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = authorization.split(" ", 1)[1]
-    return spotipy.Spotify(auth=token)
+    # each client keeps its own bearer token but they all share the one connection pool
+    client = spotipy.Spotify(auth=token, requests_session=http_session.get(), requests_timeout=HTTP_TIMEOUT)
+    if SPOTIFY_API_URL:
+        client.prefix = SPOTIFY_API_URL  # e.g. the fake server in bench/
+    return client
+
+
+def get_app_spotify_client() -> spotipy.Spotify:
+    # no user behind it (client credentials), enough for artist lookups — used by batch.py
+    auth = spotipy.SpotifyClientCredentials(
+        client_id=os.getenv("SPOTIPY_CLIENT_ID"),
+        client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+        requests_session=http_session.get(),
+        requests_timeout=HTTP_TIMEOUT,
+        cache_handler=spotipy.MemoryCacheHandler(),
+    )
+    client = spotipy.Spotify(auth_manager=auth, requests_session=http_session.get(), requests_timeout=HTTP_TIMEOUT)
+    if SPOTIFY_API_URL:
+        client.prefix = SPOTIFY_API_URL
+    return client
+
+
+# -------------------------------------------------------------------
+# Async routing — every route used to be a sync def, so they all shared
+# starlette's one threadpool and a few slow calls blocked /refresh for
+# everyone. spotipy and sqlite3 only come blocking, so routes are async
+# now and hand their blocking part to one of two thread limiters: quick
+# routes (/refresh, /playlists, /jobs) get a pool the heavy ones can't
+# fill. each user also gets USER_CONCURRENCY calls in flight at most, so
+# one heavy user only queues behind themselves
+# -------------------------------------------------------------------
+
+LIGHT_THREADS = int(os.getenv("LIGHT_THREADS", "16"))
+HEAVY_THREADS = int(os.getenv("HEAVY_THREADS", "16"))
+USER_CONCURRENCY = int(os.getenv("USER_CONCURRENCY", "4"))
+USER_MAX_JOBS = int(os.getenv("USER_MAX_JOBS", "2"))  # queued/running /generate jobs per user
+
+_thread_pools: dict[str, anyio.CapacityLimiter] = {}
+_user_limiters: dict[str, anyio.CapacityLimiter] = {}
+
+
+def _user_key(authorization: str | None) -> str:
+    # the access token stands in for the user (looking the id up would cost a Spotify call)
+    # hashed so we never keep raw tokens around as dict keys
+    return hashlib.sha1((authorization or "").encode()).hexdigest()
+
+
+def _thread_pool(kind: str) -> anyio.CapacityLimiter:
+    # created lazily because a limiter has to be made inside the event loop
+    if kind not in _thread_pools:
+        _thread_pools[kind] = anyio.CapacityLimiter(LIGHT_THREADS if kind == "light" else HEAVY_THREADS)
+    return _thread_pools[kind]
+
+
+async def _offload(kind: str, authorization: str | None, fn, *args):
+    # runs a blocking fn on the kind's thread pool, counting against the caller's limit
+    key = _user_key(authorization)
+    limiter = _user_limiters.get(key)
+    if limiter is None:
+        limiter = _user_limiters[key] = anyio.CapacityLimiter(USER_CONCURRENCY)
+    try:
+        async with limiter:
+            return await anyio.to_thread.run_sync(fn, *args, limiter=_thread_pool(kind))
+    finally:
+        # forget idle users so the dict doesn't grow with every token ever seen
+        if limiter.borrowed_tokens == 0 and limiter.statistics().tasks_waiting == 0:
+            _user_limiters.pop(key, None)
 
 
 # =======================================================================
@@ -229,46 +1907,50 @@ def get_spotify_client(authorization: str) -> spotipy.Spotify:
 # =======================================================================
 
 @app.get("/")
-def home():
+async def home():
     return {"message": "Spotify Backend is Live", "login_url": "/login"}
 
 
 @app.get("/login")
-def login():
+async def login():
     # generates the Spotify login URL and redirects the user there
     auth_url = sp_oauth.get_authorize_url()
     auth_url += "&show_dialog=true"
     return RedirectResponse(auth_url)
 
+async def _spotify_token_request(data: dict) -> dict:
+    # exchanges a code or refresh token at Spotify's accounts service
+    # done by hand (not through spotipy) so it's async and skips spotipy's caching
+    client_id = os.getenv("SPOTIPY_CLIENT_ID")
+    client_secret = os.getenv("SPOTIPY_CLIENT_SECRET")
+    credentials = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    response = await auth_http.post("https://accounts.spotify.com/api/token", headers={
+        "Authorization": f"Basic {credentials}",
+        "Content-Type": "application/x-www-form-urlencoded"
+    }, data=data)
+    token_info = response.json()
+    if response.status_code != 200 or "access_token" not in token_info:
+        raise ValueError(token_info.get("error_description") or token_info.get("error") or response.status_code)
+    return token_info
+
+
 # Spotify calls this after the user logs in, with a short-lived code
     # we exchange that code for an access token + refresh token
     # then send both to the frontend via URL params
 @app.get("/callback")
-def callback(request: Request):
+async def callback(request: Request):
     code = request.query_params.get("code")
     if not code:
         raise HTTPException(status_code=400, detail="Missing code from Spotify")
-    
-    # Exchange code for tokens manually, bypassing spotipy's caching
-    import base64
-    token_url = "https://accounts.spotify.com/api/token"
-    client_id = os.getenv("SPOTIPY_CLIENT_ID")
-    client_secret = os.getenv("SPOTIPY_CLIENT_SECRET")
-    redirect_uri = os.getenv("SPOTIPY_REDIRECT_URI")
-    
-    credentials = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    
-    import requests as req
-    response = req.post(token_url, headers={
-        "Authorization": f"Basic {credentials}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }, data={
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": redirect_uri,
-    })
-    
-    token_info = response.json()
+
+    try:
+        token_info = await _spotify_token_request({
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": os.getenv("SPOTIPY_REDIRECT_URI"),
+        })
+    except (ValueError, httpx.HTTPError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not log in with Spotify: {e}")
     access_token = token_info["access_token"]
     refresh_token = token_info.get("refresh_token", "")
     
@@ -280,7 +1962,7 @@ def callback(request: Request):
     return RedirectResponse(frontend_url)
 
 @app.post("/refresh")
-def refresh_token_endpoint(request_body: dict):
+async def refresh_token_endpoint(request_body: dict):
     # Spotify tokens expire after 1 hour
     # the frontend calls this when it gets a 401, we swap the refresh token for a new access token
     # user never notices anything happened
@@ -288,9 +1970,9 @@ def refresh_token_endpoint(request_body: dict):
     if not refresh:
         raise HTTPException(status_code=400, detail="Missing refresh_token")
     try:
-        token_info = sp_oauth.refresh_access_token(refresh)
+        token_info = await _spotify_token_request({"grant_type": "refresh_token", "refresh_token": refresh})
         return {"access_token": token_info["access_token"]}
-    except Exception as e:
+    except (ValueError, httpx.HTTPError) as e:
         raise HTTPException(status_code=401, detail=f"Could not refresh token: {e}")
 
 
@@ -300,15 +1982,19 @@ def refresh_token_endpoint(request_body: dict):
 # =======================================================================
 
 @app.get("/playlists")
-def get_playlists(authorization: str = Header(None)):
-    # returns all the user's playlists + their liked songs as a special entry
-    # Spotify only gives 50 at a time so we loop until we have everything
+async def get_playlists(authorization: str = Header(None)):
     sp = get_spotify_client(authorization)
+    return await _offload("light", authorization, _list_playlists, sp)
+
+
+def _list_playlists(sp: spotipy.Spotify) -> list[dict]:
+    # returns all the user's playlists + their liked songs as a special entry
+    # Spotify only gives 50 at a time, the pages after the first are fetched together
     result = []
 
     # liked songs isn't a real playlist in Spotify's API, it's separate
     # we fake it as a playlist with id "liked" so the frontend can treat it the same
-    liked = sp.current_user_saved_tracks(limit=1)
+    liked = _spotify_call(sp.current_user_saved_tracks, limit=1)
     result.append({
         "id": "liked",
         "name": "Liked Songs",
@@ -316,26 +2002,22 @@ def get_playlists(authorization: str = Header(None)):
         "type": "liked",
     })
 
-    offset = 0
-    while True:
-        response = sp.current_user_playlists(limit=50, offset=offset)
-        for item in response["items"]:
+    for page in _fetch_pages(lambda off: sp.current_user_playlists(limit=50, offset=off), 50):
+        for item in page["items"]:
+            if not item:
+                continue
             result.append({
                 "id": item["id"],
                 "name": item["name"],
                 "track_count": item["tracks"]["total"],
                 "type": "playlist",
             })
-        if response["next"]:
-            offset += 50
-        else:
-            break
 
     return result
 
 
 @app.get("/tracks")
-def get_tracks(playlist_ids: str, authorization: str = Header(None)):
+async def get_tracks(playlist_ids: str, authorization: str = Header(None)):
     # takes a comma-separated list of playlist IDs and returns all their tracks
     # not actually used in the main flow anymore (generate does its own fetching)
     # keeping it in case it's useful later
@@ -343,52 +2025,245 @@ def get_tracks(playlist_ids: str, authorization: str = Header(None)):
     ids = [pid.strip() for pid in playlist_ids.split(",") if pid.strip()]
     all_tracks = []
 
-    for playlist_id in ids:
-        if playlist_id == "liked":
-            tracks = _fetch_liked_songs(sp)
-        else:
-            tracks = _fetch_playlist_tracks(sp, playlist_id)
-        for track in tracks:
+    for playlist_id, library in zip(ids, await _offload("heavy", authorization, _fetch_selected, sp, ids)):
+        for track in library:
             track["playlist_source"] = playlist_id
-        all_tracks.extend(tracks)
+            all_tracks.append(track)
 
     return all_tracks
 
 
-def _fetch_liked_songs(sp: spotipy.Spotify) -> list:
-    # liked songs max out at 50 per request, so we page through all of them
-    tracks = []
+# -------------------------------------------------------------------
+# Parallel paging — Spotify tells us the total on the first page, so we
+# can work out every other offset up front and grab them all at once
+# instead of waiting for each page before asking for the next one
+# -------------------------------------------------------------------
+
+SPOTIFY_WORKERS = int(os.getenv("SPOTIFY_WORKERS", "8"))
+SPOTIFY_429_RETRIES = int(os.getenv("SPOTIFY_429_RETRIES", "5"))
+# the pools nest (playlists in parallel, each one's pages in parallel) and
+# several jobs run at once, so the thread counts alone don't bound anything.
+# this caps the Spotify requests the whole process has in flight, by default
+# at the keep-alive pool size so no connection gets opened just to be dropped
+SPOTIFY_MAX_IN_FLIGHT = int(os.getenv("SPOTIFY_MAX_IN_FLIGHT", str(HTTP_POOL_SIZE)))
+_spotify_slots = threading.BoundedSemaphore(max(1, SPOTIFY_MAX_IN_FLIGHT))
+
+
+def _spotify_call(fn, *args, **kwargs):
+    # wraps a spotipy call so a 429 waits for Retry-After and tries again
+    # spotipy already retries a few times itself, this is for when it gives up.
+    # the slot is only held for the request itself, not the back-off
+    for attempt in range(SPOTIFY_429_RETRIES + 1):
+        try:
+            with _spotify_slots:
+                return fn(*args, **kwargs)
+        except spotipy.SpotifyException as e:
+            if e.http_status != 429 or attempt == SPOTIFY_429_RETRIES:
+                raise
+            metrics.inc("spotify_rate_limit_waits_total")
+            retry_after = (e.headers or {}).get("Retry-After")
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                wait = 2 ** attempt  # no header (spotipy's own retries ran out), back off
+            time.sleep(wait)
+
+
+def _fetch_pages(fetch_page, page_size: int, progress: "Progress | None" = None) -> list[dict]:
+    # fetch_page(offset) returns one Spotify paging object
+    # first page tells us the total, the rest get fetched concurrently
+    # pool.map keeps the results in offset order so the playlist order is preserved
+    def fetch(offset: int) -> dict:
+        page = _spotify_call(fetch_page, offset)
+        if progress:
+            progress.add("tracks_fetched", len(page["items"]))
+        return page
+
+    first = fetch(0)
+    offsets = list(range(page_size, first.get("total") or 0, page_size))
+    if not offsets:
+        return [first]
+    with ThreadPoolExecutor(max_workers=min(SPOTIFY_WORKERS, len(offsets))) as pool:
+        rest = list(pool.map(fetch, offsets))
+    return [first, *rest]
+
+
+# liked songs have no snapshot_id, so we go newest-first until we hit a song
+# we already have. every so often we still do a full walk to catch removals
+LIKED_FULL_REFRESH_HOURS = float(os.getenv("LIKED_FULL_REFRESH_HOURS", "24"))
+
+
+def _add_liked_items(library: "Library", items: list[dict]):
+    for item in items:
+        track = item["track"]
+        if track:  # Spotify occasionally returns null tracks, skip those
+            library.add(_format_track(track))
+
+
+def _current_user_id(sp: spotipy.Spotify) -> str:
+    # asked for by the liked songs fetch and the generation state, one call per client
+    user_id = getattr(sp, "_ap_user_id", None)
+    if user_id is None:
+        user_id = sp._ap_user_id = _spotify_call(sp.current_user)["id"]
+    return user_id
+
+
+def _fetch_liked_songs(sp: spotipy.Spotify, progress: "Progress | None" = None) -> "Library":
+    key = f"liked:{_current_user_id(sp)}"
+    cached = _playlist_cache_get(key)
+    if cached and time.time() - cached["fetched_at"] < LIKED_FULL_REFRESH_HOURS * 3600:
+        tracks = _fetch_liked_incremental(sp, key, cached, progress)
+        if tracks is not None:
+            return tracks
+
+    # liked songs max out at 50 per request
+    pages = _fetch_pages(
+        lambda off: sp.current_user_saved_tracks(limit=50, offset=off), 50, progress
+    )
+    tracks = Library()
+    for page in pages:
+        _add_liked_items(tracks, page["items"])
+    _playlist_cache_set(key, None, pages[0].get("total") or 0, tracks)
+    return tracks
+
+
+def _fetch_liked_incremental(sp: spotipy.Spotify, key: str, cached: dict, progress: "Progress | None" = None) -> "Library | None":
+    # liked songs come back newest first, so we only page until we reach a song we've seen
+    # returns None when the counts don't add up (something was unliked), so the caller
+    # falls back to a full walk
+    known = cached["tracks"].index
+    tracks = Library()
+    new_items = 0
+    hit = None
     offset = 0
-    while True:
-        response = sp.current_user_saved_tracks(limit=50, offset=offset)
-        for item in response["items"]:
+    while hit is None:
+        page = _spotify_call(sp.current_user_saved_tracks, limit=50, offset=offset)
+        total = page.get("total") or 0
+        for item in page["items"]:
             track = item["track"]
-            if track:  # Spotify occasionally returns null tracks, skip those
-                tracks.append(_format_track(track))
-        if response["next"]:
-            offset += 50
-        else:
+            if track and track["id"] in known:
+                hit = known[track["id"]]
+                break
+            new_items += 1
+            if track:
+                tracks.add(_format_track(track))
+        if not page["next"]:
             break
+        offset += 50
+
+    # everything before `hit` in the old list must have been unliked
+    if hit is None or cached["total"] - hit + new_items != total:
+        return None
+    tracks.extend(cached["tracks"], hit)
+    if progress:
+        progress.add("tracks_fetched", len(tracks))
+    if new_items or hit:
+        # keep the original fetched_at so the periodic full refresh still happens
+        _playlist_cache_set(key, None, total, tracks, fetched_at=cached["fetched_at"])
     return tracks
 
 
-def _fetch_playlist_tracks(sp: spotipy.Spotify, playlist_id: str) -> list:
-    # same idea but for regular playlists — 100 per request this time
-    tracks = []
-    offset = 0
-    while True:
-        response = sp.playlist_tracks(playlist_id, limit=100, offset=offset)
-        for item in response["items"]:
+def _fetch_playlist_tracks(sp: spotipy.Spotify, playlist_id: str, progress: "Progress | None" = None) -> "Library":
+    # one cheap metadata call first — if the snapshot_id hasn't changed since last
+    # time, the playlist is exactly the same and we skip the whole page walk
+    meta = _spotify_call(sp.playlist, playlist_id, fields="snapshot_id,tracks.total")
+    cached = _playlist_cache_get(playlist_id)
+    if cached and cached["snapshot_id"] == meta["snapshot_id"]:
+        if progress:
+            progress.add("tracks_fetched", len(cached["tracks"]))
+        return cached["tracks"]
+
+    # same idea as liked songs but for regular playlists — 100 per request this time
+    pages = _fetch_pages(
+        lambda off: sp.playlist_tracks(playlist_id, limit=100, offset=off), 100, progress
+    )
+    # a song that's in the playlist twice is only kept once
+    tracks = Library()
+    for page in pages:
+        for item in page["items"]:
             track = item.get("track")
             if track and track.get("id"):  # skip local files, they have no ID
-                tracks.append(_format_track(track))
-        if response["next"]:
-            offset += 100
-        else:
-            break
+                tracks.add(_format_track(track))
+    _playlist_cache_set(playlist_id, meta["snapshot_id"], pages[0].get("total") or 0, tracks)
     return tracks
 
 
+def _fetch_selected(sp: spotipy.Spotify, playlist_ids: list[str], progress: "Progress | None" = None) -> list["Library"]:
+    # fetches several playlists at the same time, returns their tracks
+    # in the same order as playlist_ids
+    def fetch(pid: str) -> "Library":
+        if pid == "liked":
+            return _fetch_liked_songs(sp, progress)
+        return _fetch_playlist_tracks(sp, pid, progress)
+
+    if len(playlist_ids) <= 1:
+        return [fetch(pid) for pid in playlist_ids]
+    with ThreadPoolExecutor(max_workers=min(SPOTIFY_WORKERS, len(playlist_ids))) as pool:
+        return list(pool.map(fetch, playlist_ids))
+
+
+ARTIST_BATCH_ATTEMPTS = int(os.getenv("ARTIST_BATCH_ATTEMPTS", "3"))
+
+
+def _fetch_artist_batch(sp: spotipy.Spotify, batch: list[str]) -> dict[str, dict]:
+    # one sp.artists call (max 50 ids), retried with a short back-off
+    # if it still fails we return nothing and the caller falls back to stale cache
+    for attempt in range(ARTIST_BATCH_ATTEMPTS):
+        try:
+            result = _spotify_call(sp.artists, batch)
+            return {
+                a["id"]: {"name": a["name"], "genres": a.get("genres", [])}
+                for a in result["artists"] if a
+            }
+        except Exception as e:
+            if attempt == ARTIST_BATCH_ATTEMPTS - 1:
+                print(f"spotify artists error: {e}")
+            else:
+                time.sleep(0.5 * 2 ** attempt)
+    return {}
+
+
+def _resolve_artist_genres(
+    sp: spotipy.Spotify | None, artist_ids: list[str], progress: "Progress | None" = None
+) -> dict[str, list[str]]:
+    # returns {artist_id: [Title Cased Genres]}
+    # only artists missing from artist_cache (or past the TTL) hit Spotify,
+    # 50 per call, with the calls running concurrently. with no client
+    # (batch.py --offline) whatever the cache has is all we get
+    cached = _artist_cache_get(artist_ids)
+    to_fetch = [aid for aid in artist_ids if sp is not None and not cached.get(aid, {}).get("fresh")]
+    if progress:
+        progress.add("artists_resolved", len(artist_ids) - len(to_fetch))
+
+    # artists another job is already looking up are waited on instead of fetched twice
+    mine, theirs = artist_flight.claim(to_fetch)
+    fetched: dict[str, dict] = {}
+    batches = [mine[i:i+50] for i in range(0, len(mine), 50)]
+    try:
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(SPOTIFY_WORKERS, len(batches))) as pool:
+                for batch, result in zip(batches, pool.map(lambda b: _fetch_artist_batch(sp, b), batches)):
+                    fetched.update(result)
+                    artist_flight.resolve({aid: result.get(aid) for aid in batch})
+                    if progress:
+                        progress.add("artists_resolved", len(batch))
+        _artist_cache_set(fetched)
+    finally:
+        artist_flight.release(mine)
+
+    if theirs:
+        fetched.update(SingleFlight.wait(theirs))
+        if progress:
+            progress.add("artists_resolved", len(theirs))
+
+    genres: dict[str, list[str]] = {}
+    for aid in artist_ids:
+        entry = fetched.get(aid) or cached.get(aid)  # stale beats nothing
+        if entry:
+            genres[aid] = [g.title() for g in entry["genres"]]
+    return genres
+
+
 def _format_track(track: dict) -> dict:
     # strips out only the fields we actually need from Spotify's massive track object
     return {
@@ -397,80 +2272,609 @@ def _format_track(track: dict) -> dict:
         "artists": [{"id": a["id"], "name": a["name"]} for a in track["artists"]],
         "album": track["album"]["name"],
         "release_date": track["album"]["release_date"],
+        "isrc": ((track.get("external_ids") or {}).get("isrc") or "").upper() or None,
+        "song_key": _song_key(track["name"], track["artists"][0]["id"] if track["artists"] else None),
     }
 
 
+# -------------------------------------------------------------------
+# Library model — a /generate run holds every track of the selected
+# playlists at once, and a dict per track plus a dict per credited artist
+# adds up fast on 30k+ song libraries. Library keeps the tracks column-wise
+# instead: one list per field, artists interned into their own table and
+# referenced by number, and every track id mapped to a dense index, so
+# grouping works on small ints. it's also the shape playlist contents are
+# cached in. track(i) turns a row back into a _format_track dict for the
+# places that want one (the AI prompt, extractors, the retry queue) — only
+# ever for the songs being processed, not the whole library
+# -------------------------------------------------------------------
+
+class Library:
+    __slots__ = (
+        "ids", "index", "names", "albums", "release_dates", "isrcs", "song_keys",
+        "artist_refs", "artist_offsets", "artist_ids", "artist_names", "artist_index", "_artist_dicts",
+    )
+    COLUMNS = ("ids", "names", "albums", "release_dates", "isrcs", "song_keys", "artist_ids", "artist_names")
+
+    def __init__(self):
+        self.ids: list[str] = []
+        self.index: dict[str, int] = {}  # track id -> position
+        self.names: list[str] = []
+        self.albums: list[str | None] = []
+        self.release_dates: list[str | None] = []
+        self.isrcs: list[str | None] = []
+        self.song_keys: list[str | None] = []
+        # track i's artists are artist_refs[artist_offsets[i]:artist_offsets[i + 1]]
+        self.artist_refs = array("I")
+        self.artist_offsets = array("I", [0])
+        self.artist_ids: list[str | None] = []
+        self.artist_names: list[str] = []
+        self.artist_index: dict[str | None, int] = {}
+        self._artist_dicts: list[dict] = []  # one shared {"id", "name"} per artist for track()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.track(i) for i in range(len(self.ids)))
+
+    def _intern_artist(self, artist_id: str | None, name: str) -> int:
+        ref = self.artist_index.get(artist_id)
+        if ref is None:
+            ref = self.artist_index[artist_id] = len(self.artist_ids)
+            self.artist_ids.append(artist_id)
+            self.artist_names.append(name)
+            self._artist_dicts.append({"id": artist_id, "name": name})
+        return ref
+
+    def _append(self, tid: str, name: str, album, release_date, isrc, song_key, artist_refs):
+        self.index[tid] = len(self.ids)
+        self.ids.append(tid)
+        self.names.append(name)
+        self.albums.append(album)
+        self.release_dates.append(release_date)
+        self.isrcs.append(isrc)
+        self.song_keys.append(song_key)
+        self.artist_refs.extend(artist_refs)
+        self.artist_offsets.append(len(self.artist_refs))
+
+    def add(self, track: dict) -> bool:
+        # appends a _format_track dict, False if the track is already in (first one wins)
+        if track["track_id"] in self.index:
+            return False
+        self._append(
+            track["track_id"], track.get("name") or "", track.get("album"), track.get("release_date"),
+            track.get("isrc"), track.get("song_key"),
+            [self._intern_artist(a["id"], a["name"]) for a in track["artists"]],
+        )
+        return True
+
+    def extend(self, other: "Library", start: int = 0):
+        # copies other's tracks from position `start` on, skipping ones already in
+        for i in range(start, len(other)):
+            tid = other.ids[i]
+            if tid in self.index:
+                continue
+            self._append(
+                tid, other.names[i], other.albums[i], other.release_dates[i], other.isrcs[i], other.song_keys[i],
+                [self._intern_artist(other.artist_ids[r], other.artist_names[r]) for r in other.artists(i)],
+            )
+
+    @classmethod
+    def from_tracks(cls, tracks) -> "Library":
+        library = cls()
+        for track in tracks:
+            library.add(track)
+        return library
+
+    @classmethod
+    def merge(cls, parts: list["Library"]) -> "Library":
+        # several playlists -> one deduped library, in the order they were selected
+        if len(parts) == 1:
+            return parts[0]
+        library = cls()
+        for part in parts:
+            library.extend(part)
+        return library
+
+    def artists(self, i: int) -> array:
+        return self.artist_refs[self.artist_offsets[i]:self.artist_offsets[i + 1]]
+
+    def artist_name(self, artist_id: str, default: str | None = None) -> str | None:
+        ref = self.artist_index.get(artist_id)
+        return self.artist_names[ref] if ref is not None else default
+
+    def track(self, i: int) -> dict:
+        return {
+            "track_id": self.ids[i],
+            "name": self.names[i],
+            "artists": [self._artist_dicts[r] for r in self.artists(i)],
+            "album": self.albums[i],
+            "release_date": self.release_dates[i],
+            "isrc": self.isrcs[i],
+            "song_key": self.song_keys[i],
+        }
+
+    def to_json(self) -> dict:
+        data = {c: getattr(self, c) for c in self.COLUMNS}
+        data["artist_refs"] = self.artist_refs.tolist()
+        data["artist_offsets"] = self.artist_offsets.tolist()
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Library":
+        library = cls()
+        for c in cls.COLUMNS:
+            setattr(library, c, data[c])
+        library.artist_refs = array("I", data["artist_refs"])
+        library.artist_offsets = array("I", data["artist_offsets"])
+        library.index = {tid: i for i, tid in enumerate(library.ids)}
+        library.artist_index = {aid: r for r, aid in enumerate(library.artist_ids)}
+        library._artist_dicts = [{"id": aid, "name": name} for aid, name in zip(library.artist_ids, library.artist_names)]
+        return library
+
+
+# -------------------------------------------------------------------
+# Grouping — every kind of generated playlist (genre, language, artist...)
+# is a "dimension": a function that returns the groups one track belongs to.
+# _track_memberships runs every selected dimension over the new tracks once
+# and _group_tracks merges those into the last run's buckets. buckets hold
+# Library positions and are sorted at the end, so tracks keep their playlist
+# order; only the playlists that make the cut get turned back into track ids.
+# buckets are what generation_state stores, so a rerun only extracts the new
+# tracks. to add a new kind of playlist, write an extractor and add it to
+# DIMENSIONS
+# ctx holds the lookups the extractors need: artist_genres, library, llm
+# -------------------------------------------------------------------
+
+def _genre_groups(track: dict, ctx: dict):
+    # first try Spotify genres, fall back to AI genre if Spotify had nothing
+    # then normalise everything into clean buckets (e.g. "k-pop" -> "K-Pop")
+    raw_genres: dict[str, None] = {}
+    for artist in track["artists"]:
+        for g in ctx["artist_genres"].get(artist["id"], ()):
+            raw_genres[g] = None
+    if not raw_genres:
+        llm_genre = ctx["llm"].get(track["track_id"], {}).get("llm_genre")
+        if llm_genre:
+            raw_genres[llm_genre] = None
+    genres = {_normalise_genre(g): None for g in raw_genres}
+    return genres or ("Other",)
+
+def _language_groups(track: dict, ctx: dict):
+    # entirely AI-driven since Spotify has no language data at all
+    return (ctx["llm"].get(track["track_id"], {}).get("language") or "Unknown",)
+
+def _artist_groups(track: dict, ctx: dict):
+    return {a["id"]: None for a in track["artists"] if a["id"]}
+
+def _decade_groups(track: dict, ctx: dict):
+    # release_date can be "1987-05-01", "1987-05", "1987" or "0000" for unknown
+    year = (track.get("release_date") or "")[:4]
+    if not year.isdigit() or year == "0000":
+        return ()
+    return (f"{year[:3]}0s",)
+
+def _album_groups(track: dict, ctx: dict):
+    # album names alone clash a lot ("Greatest Hits"), so the main artist goes in the name too
+    if not track.get("album") or not track["artists"]:
+        return ()
+    return (f"{track['album']} — {track['artists'][0]['name']}",)
+
+
+# name -> extractor, whether it's on by default, and which options cap it
+#   max:   (option name, default) — how many playlists of this kind at most
+#   min:   (option name, default, floor) — how many songs a group needs to count
+#   label: turns a group key into the playlist name
+DIMENSIONS = {
+    "genre":    {"groups": _genre_groups,    "default": True,  "max": ("max_genres", 10)},
+    "language": {"groups": _language_groups, "default": True,  "max": ("max_languages", 3)},
+    "artist":   {
+        "groups": _artist_groups, "default": True, "max": ("max_artists", 5),
+        # minimum 3, can't go lower — an artist with 2 songs isn't a playlist
+        "min": ("artist_min_appearances", 5, 3),
+        "label": lambda aid, ctx: ctx["library"].artist_name(aid, "Unknown Artist"),
+    },
+    "decade":   {"groups": _decade_groups,   "default": False, "max": ("max_decades", 5)},
+    "album":    {
+        "groups": _album_groups, "default": False, "max": ("max_albums", 5),
+        "min": ("album_min_tracks", 5, 2),
+    },
+}
+
+
+def _selected_dimensions(opts: dict) -> dict[str, dict]:
+    return {name: dim for name, dim in DIMENSIONS.items() if opts.get(name, dim["default"])}
+
+
+def _track_memberships(tracks: list[dict], dimensions: dict[str, dict], ctx: dict) -> dict[str, dict[str, list]]:
+    # returns {track_id: {dimension: [group key, ...]}}
+    return {
+        track["track_id"]: {name: list(dim["groups"](track, ctx)) for name, dim in dimensions.items()}
+        for track in tracks
+    }
+
+
+def _group_tracks(
+    library: "Library",
+    stored: dict[str, dict[str, list[str]]],
+    fresh: dict[str, dict[str, list]],
+    dimensions,
+    skip: set[str] = frozenset(),
+) -> dict[str, dict[str, list[int]]]:
+    # returns {dimension: {group key: [library position, ...]}}, positions ascending.
+    # stored is the last run's {dimension: {group key: [track id, ...]}} — ids no longer
+    # in the library or in `skip` (being redone) drop out — and fresh is
+    # _track_memberships for the tracks processed this run
+    index = library.index
+    groups: dict[str, dict[str, list[int]]] = {}
+    for name in dimensions:
+        buckets = groups[name] = {}
+        for key, tids in stored.get(name, {}).items():
+            members = [index[tid] for tid in tids if tid in index and tid not in skip]
+            if members:
+                buckets[key] = members
+    for tid, dims in fresh.items():
+        i = index[tid]
+        for name, keys in dims.items():
+            buckets = groups[name]
+            for key in keys:
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [i]
+                else:
+                    bucket.append(i)
+    # a track is only ever in a bucket once (extractors return unique keys), sorting
+    # puts everyone back in playlist order — mostly already sorted runs, so it's cheap
+    for buckets in groups.values():
+        for bucket in buckets.values():
+            bucket.sort()
+    return groups
+
+
+def _top_groups(
+    buckets: dict[str, list[int]], ids: list[str], limit: int, min_size: int = 1, label=None
+) -> dict[str, list[str]]:
+    # sort by most songs, drop anything under min_size, take the top N.
+    # ties go to the group whose first song comes earliest in the library —
+    # the order a from-scratch run would have created them in, whereas an
+    # incremental run builds the buckets stored-first
+    ranked = sorted(
+        (item for item in buckets.items() if len(item[1]) >= min_size),
+        key=lambda item: (-len(item[1]), item[1][0]),
+    )
+    return {(label(key) if label else key): [ids[i] for i in members] for key, members in ranked[:limit]}
+
+
+def _build_groups(
+    groups: dict[str, dict[str, list[int]]], library: "Library", opts: dict, ctx: dict
+) -> dict[str, dict[str, list[str]]]:
+    # tracks are already unique, so allow_duplicates doesn't change the grouping —
+    # a track can always land in more than one playlist (e.g. two genres)
+    selected = _selected_dimensions(opts)
+
+    # genre / language / artist are always in the response so the frontend can rely on them
+    results: dict[str, dict[str, list[str]]] = {"genre": {}, "language": {}, "artist": {}}
+    for name, dim in selected.items():
+        max_opt, max_default = dim["max"]
+        min_size = 1
+        if "min" in dim:
+            min_opt, min_default, min_floor = dim["min"]
+            min_size = max(min_floor, int(opts.get(min_opt, min_default)))
+        label = dim.get("label")
+        results[name] = _top_groups(
+            groups[name], library.ids, int(opts.get(max_opt, max_default)), min_size,
+            (lambda key, label=label: label(key, ctx)) if label else None,
+        )
+    return results
+
+
 # =======================================================================
 # GENERATION PIPELINE
-# this is the main endpoint — does all the heavy lifting
-# takes selected playlists + options, returns grouped playlist data
+# this does all the heavy lifting — takes selected playlists + options,
+# returns grouped playlist data. it runs as a background job (see JOBS below)
+# so /generate can answer straight away
 # =======================================================================
 
-@app.post("/generate")
-def generate(request_body: dict, authorization: str = Header(None)):
-    sp = get_spotify_client(authorization)
-    opts = request_body.get("options", {})
-    playlist_ids = request_body.get("playlist_ids", [])
+# -------------------------------------------------------------------
+# Artist-level inference — an artist with 40 songs and no Spotify genres
+# used to cost 40 genre lookups and 40 language lookups. once enough of an
+# artist's songs agree (ARTIST_INFERENCE_MIN_TRACKS songs, at least
+# ARTIST_INFERENCE_AGREEMENT of them the same) we save that and give it to
+# the rest of their songs. collabs between artists who disagree are outliers
+# and still go to the AI. guesses are never written into song_cache, so
+# they can't vote for themselves next time. only AI answers vote on language:
+# an artist whose Hangul-titled songs were read off the script would
+# otherwise make their English singles Korean too
+# -------------------------------------------------------------------
 
-    # read all the options the user set on the frontend
-    want_genre    = opts.get("genre", True)
-    want_artist   = opts.get("artist", True)
-    want_language = opts.get("language", True)
-    allow_dupes   = opts.get("allow_duplicates", False)
-    artist_min    = max(3, int(opts.get("artist_min_appearances", 5)))  # minimum 3, can't go lower
-    max_genres    = int(opts.get("max_genres", 10))
-    max_artists   = int(opts.get("max_artists", 5))
-    max_languages = int(opts.get("max_languages", 3))
+ARTIST_INFERENCE_MIN_TRACKS = int(os.getenv("ARTIST_INFERENCE_MIN_TRACKS", "4"))
+ARTIST_INFERENCE_AGREEMENT = float(os.getenv("ARTIST_INFERENCE_AGREEMENT", "0.8"))
+LLM_FIELDS = ("language", "llm_genre")
+
+
+def _primary_artist(track: dict) -> str | None:
+    return track["artists"][0]["id"] if track["artists"] else None
+
+
+def _artist_consensus(tracks: list[dict], known: dict[str, dict]) -> dict[str, dict]:
+    # votes per main artist over songs we actually classified (cache or AI, and
+    # for genre the script check too — it never answers genre)
+    # returns {artist_id: {"language", "language_votes", "llm_genre", "genre_votes"}}
+    # with only the fields that cleared the bar
+    votes: dict[str, dict[str, dict[str, int]]] = {}
+    for track in tracks:
+        aid = _primary_artist(track)
+        entry = known.get(track["track_id"])
+        if not aid or not entry:
+            continue
+        for field in LLM_FIELDS:
+            value = entry.get(field)
+            if field == "language" and entry.get("language_source") == "script":
+                continue
+            if value:
+                counter = votes.setdefault(aid, {}).setdefault(field, {})
+                counter[value] = counter.get(value, 0) + 1
+
+    consensus: dict[str, dict] = {}
+    for aid, fields in votes.items():
+        for field, counter in fields.items():
+            total = sum(counter.values())
+            value, count = max(counter.items(), key=lambda kv: kv[1])
+            if total >= ARTIST_INFERENCE_MIN_TRACKS and count / total >= ARTIST_INFERENCE_AGREEMENT:
+                out = consensus.setdefault(aid, {})
+                out[field] = value
+                out["language_votes" if field == "language" else "genre_votes"] = total
+    return consensus
+
+
+def _propagate(track: dict, field: str, inference: dict[str, dict]) -> str | None:
+    # the main artist's guess, unless another artist on the song disagrees
+    aid = _primary_artist(track)
+    value = inference.get(aid, {}).get(field) if aid else None
+    if not value:
+        return None
+    # language votes come from AI answers, which are almost all Latin-titled
+    # songs. a title in another script says more than the artist's other songs
+    if field == "language" and any(_char_script(ch) for ch in track["name"] if ch.isalpha()):
+        return None
+    for artist in track["artists"][1:]:
+        other = inference.get(artist["id"], {}).get(field)
+        if other and other != value:
+            return None
+    return value
+
+
+def _classify_tracks(
+    tracks: list[dict],
+    need_language: set[str],
+    need_genre: set[str],
+    existing_genres: set[str],
+    progress: "Progress",
+) -> dict[str, dict]:
+    # fills in language / llm_genre for every track that needs them and returns
+    # {track_id: {"language", "llm_genre", ...}}. cheapest sources first:
+    # song_cache -> script check -> artist guesses -> AI
+    needed = need_language | need_genre
+    known = _cache_lookup([t for t in tracks if t["track_id"] in needed], need_language, need_genre)
+    cached_count = len(known)
+    by_id = {t["track_id"]: t for t in tracks}
+
+    def missing(track: dict) -> list[str]:
+        tid = track["track_id"]
+        c = known.get(tid, {})
+        fields = []
+        if tid in need_language and not c.get("language"):
+            fields.append("language")
+        if tid in need_genre and not c.get("llm_genre"):
+            fields.append("llm_genre")
+        return fields
+
+    # songs titled in a non-Latin script get their language from the script itself
+    local_results: dict[str, dict] = {}
+    for track in tracks:
+        if "language" in missing(track):
+            language = _detect_script_language(track)
+            if language:
+                local_results[track["track_id"]] = {"language": language, "language_source": "script"}
+    _cache_set(local_results, by_id)
+    _merge_llm(known, local_results)
+
+    # artist guesses only count when they cover everything a song is missing,
+    # otherwise the song goes to the AI as usual
+    propagated: dict[str, dict] = {}
+
+    def apply_inference(pending: list[dict], inference: dict[str, dict]) -> list[dict]:
+        leftover = []
+        for track in pending:
+            fields = missing(track)
+            guesses = {f: _propagate(track, f, inference) for f in fields}
+            if all(guesses.values()):
+                if "language" in guesses:
+                    guesses["language_source"] = "artist"
+                propagated[track["track_id"]] = guesses
+            else:
+                leftover.append(track)
+        return leftover
+
+    pending = [t for t in tracks if missing(t)]
+    artist_ids = list({aid for t in pending if (aid := _primary_artist(t))} |
+                      {a["id"] for t in pending for a in t["artists"][1:] if a["id"]})
+    pending = apply_inference(pending, _artist_inference_get(artist_ids))
+
+    # first AI pass: for artists with lots of unknown songs, only send enough to
+    # learn what the artist is, and hold the rest back
+    known_per_artist: dict[str, int] = {}
+    for t in tracks:
+        aid = _primary_artist(t)
+        if aid and t["track_id"] in known:
+            known_per_artist[aid] = known_per_artist.get(aid, 0) + 1
+    first, deferred = [], []
+    for track in pending:
+        aid = _primary_artist(track)
+        if aid and known_per_artist.get(aid, 0) >= ARTIST_INFERENCE_MIN_TRACKS:
+            deferred.append(track)
+        else:
+            first.append(track)
+            if aid:
+                known_per_artist[aid] = known_per_artist.get(aid, 0) + 1
+
+    progress.set(
+        stage="classifying", llm_cached=cached_count, language_local=len(local_results),
+    )
+    _classify_with_llm(first, known, need_language, need_genre, existing_genres, progress)
+
+    # second pass: now that we've heard from every artist, guess the held-back
+    # songs and send only the outliers
+    consensus = _artist_consensus(tracks, known)
+    leftover = apply_inference(deferred, consensus)
+    progress.set(artist_propagated=len(propagated))
+    _classify_with_llm(leftover, known, need_language, need_genre, existing_genres, progress)
+
+    _artist_inference_set(_artist_consensus(tracks, known))
+
+    full_llm = dict(known)
+    _merge_llm(full_llm, propagated)
+    return full_llm
+
+
+def _classify_with_llm(
+    to_call: list[dict],
+    known: dict[str, dict],
+    need_language: set[str],
+    need_genre: set[str],
+    existing_genres: set[str],
+    progress: "Progress",
+):
+    # batches run concurrently and size themselves (see _run_groq_queue), results
+    # land in `known` and get saved to song_cache as each one finishes — that's
+    # the checkpoint, if the job dies halfway a rerun only pays for the batches
+    # that never finished
+    # songs the retry queue already owns are left to it, no point paying twice
+    waiting = _pending_ids([t["track_id"] for t in to_call])
+    to_call = [t for t in to_call if t["track_id"] not in waiting]
+
+    # one question per song and field: releases of the same song share the
+    # answer, and whatever another job is already asking about is waited on
+    by_key: dict[str, list[dict]] = {}
+    for t in to_call:
+        for field, need in (("language", need_language), ("llm_genre", need_genre)):
+            if t["track_id"] in need:
+                by_key.setdefault(f"{_song_id(t)}:{field}", []).append(t)
+    mine, theirs = llm_flight.claim(by_key)
+    my_language = {by_key[key][0]["track_id"] for key in mine if key.endswith(":language")}
+    my_genre = {by_key[key][0]["track_id"] for key in mine if key.endswith(":llm_genre")}
+    owned = {(tid, "language") for tid in my_language} | {(tid, "llm_genre") for tid in my_genre}
+    mine_tracks = [t for t in to_call if t["track_id"] in my_language or t["track_id"] in my_genre]
+    by_id = {t["track_id"]: t for t in mine_tracks}
+    answers: dict[str, str] = {}
+
+    def on_batch(results: dict[str, dict]):
+        # a batch asks for every field any of its songs needs, so drop answers
+        # for fields we already had (e.g. a language the script check found)
+        # or that another job is finding out for us
+        kept = {}
+        for tid, v in results.items():
+            fields = {
+                f: x for f, x in v.items()
+                if f not in LLM_FIELDS or (not known.get(tid, {}).get(f) and (tid, f) in owned)
+            }
+            if not fields.get("language"):
+                fields.pop("language_source", None)
+            kept[tid] = fields
+        results = kept
+        _merge_llm(known, results)
+        _cache_set(results, by_id)
+        found = {
+            f"{_song_id(by_id[tid])}:{f}": v for tid, fields in results.items()
+            for f, v in fields.items() if f in LLM_FIELDS and v
+        }
+        answers.update(found)
+        llm_flight.resolve(found)
+        progress.add("llm_tracks_done", len(results))
+
+    progress.add("llm_tracks_total", len(mine_tracks))
+    try:
+        _run_groq_queue(mine_tracks, existing_genres, my_language, my_genre, on_batch, progress)
+    finally:
+        llm_flight.release(mine)
+
+    # anything still missing goes to the retry queue instead of being retried here
+    failed = [
+        t for t in mine_tracks
+        if (t["track_id"] in my_language and not known.get(t["track_id"], {}).get("language"))
+        or (t["track_id"] in my_genre and not known.get(t["track_id"], {}).get("llm_genre"))
+    ]
+    _pending_add(failed, my_language, my_genre, "no answer from groq")
+
+    # hand every answer to the other releases of the same song, plus whatever
+    # other jobs found out (they've already saved those to song_cache themselves)
+    answers.update(SingleFlight.wait({key: f for key, f in theirs.items() if key not in answers}))
+    shared: dict[str, dict] = {}
+    for key, value in answers.items():
+        field = key.rsplit(":", 1)[1]
+        for t in by_key.get(key, []):
+            if not known.get(t["track_id"], {}).get(field) and (t["track_id"], field) not in owned:
+                shared.setdefault(t["track_id"], {})[field] = value
+                if field == "language":
+                    shared[t["track_id"]]["language_source"] = "llm"
+    _merge_llm(known, shared)
+    progress.add("llm_shared", len(shared))
+    progress.add("llm_deferred", len(failed) + len(waiting))
+
+
+def _run_pipeline(sp: spotipy.Spotify, playlist_ids: list[str], opts: dict, progress: "Progress") -> dict:
 
     # --- step 1: fetch all tracks from selected playlists ---
+    # playlists are fetched in parallel, results come back in the order they were selected
     # if the same song appears in two playlists, we only process it once
-    all_tracks = []
-    seen_ids: set[str] = set()
-    for pid in playlist_ids:
-        raw = _fetch_liked_songs(sp) if pid == "liked" else _fetch_playlist_tracks(sp, pid)
-        all_tracks.extend(raw)
-
-    unique_tracks = []
-    for t in all_tracks:
-        if t["track_id"] not in seen_ids:
-            seen_ids.add(t["track_id"])
-            unique_tracks.append(t)
-
-    # --- step 2: get genre tags from Spotify for every artist ---
+    # (Library dedupes on the way in, the first occurrence wins)
+    progress.set(stage="fetching_tracks")
+    library = Library.merge(_fetch_selected(sp, playlist_ids, progress))
+    state_key = f"{_current_user_id(sp)}:{','.join(playlist_ids)}"
+    return _process_tracks(sp, library, opts, progress, state_key)
+
+
+def _classify_changed(
+    sp: spotipy.Spotify | None,
+    library: Library,
+    changed_positions: list[int],
+    changed: list[dict],
+    opts: dict,
+    progress: "Progress",
+    genre_hint=(),
+) -> dict:
+    # steps 3-5 of the pipeline: artist genres, then language / genre for the
+    # changed songs, every answer saved to the cache as it comes in. nothing is
+    # grouped here, so batch.py --warm-only stops after this
+    want_genre    = opts.get("genre", True)
+    want_language = opts.get("language", True)
+
+    # --- step 3: get genre tags from Spotify for every new artist ---
     # Spotify gives genres per artist, not per track, so we collect all artist IDs
-    # then batch-fetch them 50 at a time (that's Spotify's API limit per call)
-    artist_id_to_genres: dict[str, list[str]] = {}
-    artist_id_to_name: dict[str, str] = {}
-    all_artist_ids: list[str] = []
-
-    for track in unique_tracks:
-        for artist in track["artists"]:
-            if artist["id"] not in artist_id_to_name:
-                artist_id_to_name[artist["id"]] = artist["name"]
-                all_artist_ids.append(artist["id"])
-
-    for i in range(0, len(all_artist_ids), 50):
-        batch = all_artist_ids[i:i+50]
-        try:
-            result = sp.artists(batch)
-            for a in result["artists"]:
-                if a:
-                    artist_id_to_genres[a["id"]] = [g.title() for g in a.get("genres", [])]
-        except Exception:
-            pass  # if a batch fails just skip it, not worth crashing over
+    # anything already in artist_cache is reused, the rest is batch-fetched 50 at a time
+    changed_artist_ids = [
+        aid for aid in (library.artist_ids[r] for r in dict.fromkeys(
+            r for i in changed_positions for r in library.artists(i)
+        )) if aid
+    ]
+
+    progress.set(stage="resolving_artists", tracks_total=len(library), artists_total=len(changed_artist_ids))
+    artist_id_to_genres = _resolve_artist_genres(sp, changed_artist_ids, progress)
 
     # collect every genre Spotify gave us — used later as a hint for the AI
-    existing_spotify_genres: set[str] = set()
+    # (kept in the state too, the unchanged songs' artists aren't resolved again)
+    existing_spotify_genres: set[str] = set(genre_hint)
     for genres in artist_id_to_genres.values():
         existing_spotify_genres.update(genres)
 
-    # --- step 3: figure out which tracks need the AI ---
+    # --- step 4: figure out which tracks need the AI ---
     # genre: only send to AI if Spotify had nothing for all that track's artists
     # language: always send to AI, Spotify has zero language data
     tracks_need_llm_genre: set[str] = set()
     tracks_need_language: set[str] = set()
 
-    for track in unique_tracks:
+    for track in changed:
         has_spotify_genre = any(
             artist_id_to_genres.get(a["id"], []) for a in track["artists"]
         )
@@ -479,176 +2883,693 @@ def generate(request_body: dict, authorization: str = Header(None)):
         if want_language:
             tracks_need_language.add(track["track_id"])
 
-    # --- step 4: check cache, then call AI for anything not cached ---
-    all_llm_ids = list(tracks_need_llm_genre | tracks_need_language)
-    cached = _cache_get(all_llm_ids)
-
-    def needs_groq(track: dict) -> bool:
-        # returns True if this track is missing any info we need from the AI
-        tid = track["track_id"]
-        c = cached.get(tid, {})
-        if tid in tracks_need_language and not c.get("language"):
-            return True
-        if tid in tracks_need_llm_genre and not c.get("llm_genre"):
-            return True
-        return False
-
-    to_call = [t for t in unique_tracks if needs_groq(t)]
-
-    # 25 per batch — Llama cuts off the JSON response if we send more than that
-    new_cache: dict[str, dict] = {}
-    BATCH = 25
-    for i in range(0, len(to_call), BATCH):
-        batch = to_call[i:i+BATCH]
-        need_lang  = any(t["track_id"] in tracks_need_language  for t in batch)
-        need_genre = any(t["track_id"] in tracks_need_llm_genre for t in batch)
-
-        results = _call_groq_batch(
-            tracks=batch,
-            existing_genres=existing_spotify_genres,
-            need_language=need_lang,
-            need_genre=need_genre,
-        )
-        new_cache.update(results)
+    # --- step 5: cache, local script check, artist-level guesses, then the AI for the rest ---
+    full_llm = _classify_tracks(
+        changed, tracks_need_language, tracks_need_llm_genre, existing_spotify_genres, progress
+    )
 
-    _cache_set(new_cache)
-    full_llm: dict[str, dict] = {**cached, **new_cache}
+    return {
+        "artist_genres": artist_id_to_genres,
+        "genre_hint":    existing_spotify_genres,
+        "need_language": tracks_need_language,
+        "need_genre":    tracks_need_llm_genre,
+        "llm":           full_llm,
+    }
 
-    # --- step 5: build artist playlists ---
-    # count how many tracks each artist appears in across all selected playlists
-    # only artists above the threshold get a playlist, sorted by most tracks
-    artist_results: dict[str, list[str]] = {}
 
-    if want_artist:
-        artist_count: dict[str, int] = {}
-        artist_tracks: dict[str, list[str]] = {}
+def _classify_library(sp: spotipy.Spotify | None, library: Library, opts: dict, progress: "Progress") -> dict:
+    # steps 3-5 for every track in the library and nothing after: fills the
+    # cache without building groups or track_details. used by batch.py --warm-only
+    positions = list(range(len(library)))
+    return _classify_changed(sp, library, positions, [library.track(i) for i in positions], opts, progress)
 
-        for track in unique_tracks:
-            for artist in track["artists"]:
-                aid = artist["id"]
-                artist_count[aid] = artist_count.get(aid, 0) + 1
-                artist_tracks.setdefault(aid, []).append(track["track_id"])
 
-        qualifying = sorted(
-            [(aid, cnt) for aid, cnt in artist_count.items() if cnt >= artist_min],
-            key=lambda x: x[1], reverse=True
-        )
-        for aid, _ in qualifying[:max_artists]:
-            name = artist_id_to_name.get(aid, "Unknown Artist")
-            artist_results[name] = artist_tracks[aid]
+def _process_tracks(
+    sp: spotipy.Spotify | None,
+    library: Library,
+    opts: dict,
+    progress: "Progress",
+    state_key: str | None = None,
+) -> dict:
+    # steps 2-6 of the pipeline, for tracks that are already fetched —
+    # shared by /generate and the offline batch CLI (batch.py). the generation
+    # state is only used when there's a state_key to keep it under.
+    # _classify_library above is the same without the grouping
 
-    # --- step 6: build genre playlists ---
-    # first try Spotify genres, fall back to AI genre if Spotify had nothing
-    # then normalise everything into clean buckets (e.g. "k-pop" -> "K-Pop")
-    genre_results: dict[str, list[str]] = {}
+    # read the options that decide what the AI is needed for
+    # (limits and the rest are read by _build_groups)
+    want_genre    = opts.get("genre", True)
+    want_language = opts.get("language", True)
 
-    if want_genre:
-        genre_tracks: dict[str, list[str]] = {}
+    # --- step 2: work out what changed since the last run ---
+    # generation_state keeps the groups every track landed in last time for this
+    # user + playlist selection. only songs that weren't there (or that the AI
+    # hadn't answered yet) go through steps 3-5, everything else is regrouped
+    # straight from the stored groups. removed songs just drop out of them
+    selected = _selected_dimensions(opts)
+    signature = json.dumps([
+        sorted(selected), bool(want_genre), bool(want_language),
+        _current_genre_index().signature, TRACK_FORMAT_VERSION, GENERATION_STATE_FORMAT,
+    ])
+    state = _generation_state_get(state_key, signature) if state_key else None
+    previous = set(state["track_ids"]) if state else set()
+    retry = set(state["unresolved"]) if state else set()
+    changed_positions = [i for i, tid in enumerate(library.ids) if tid not in previous or tid in retry]
+    removed = sum(1 for tid in previous if tid not in library.index)
+    progress.set(tracks_new=len(changed_positions), tracks_removed=removed)
+    metrics.inc("generate_tracks_total", len(changed_positions), kind="processed")
+    metrics.inc("generate_tracks_total", len(library) - len(changed_positions), kind="reused")
+    # full dicts only for the songs that actually get processed
+    changed = [library.track(i) for i in changed_positions]
+
+    # --- steps 3-5: artist genres, then language / genre for the new songs ---
+    classified = _classify_changed(
+        sp, library, changed_positions, changed, opts, progress, state["genre_hint"] if state else ()
+    )
+    artist_id_to_genres = classified["artist_genres"]
+    existing_spotify_genres = classified["genre_hint"]
+    tracks_need_language = classified["need_language"]
+    tracks_need_llm_genre = classified["need_genre"]
+    full_llm = classified["llm"]
+
+    progress.set(stage="grouping")
+
+    # --- step 6: group everything into playlists ---
+    # extract the new tracks' groups, then merge them into the stored buckets in
+    # the current track order so the result is the same as grouping from scratch
+    ctx = {
+        "artist_genres": artist_id_to_genres,
+        "library":       library,
+        "llm":           full_llm,
+    }
+    groups = _group_tracks(
+        library, state["groups"] if state else {}, _track_memberships(changed, selected, ctx), selected, retry
+    )
+    del changed  # the per-track dicts aren't needed past here
+    results = _build_groups(groups, library, opts, ctx)
+
+    # songs the AI didn't answer for (yet) landed in Unknown / Other, try them again next run
+    unresolved = [
+        tid for tid in tracks_need_language | tracks_need_llm_genre
+        if (tid in tracks_need_language and not full_llm.get(tid, {}).get("language"))
+        or (tid in tracks_need_llm_genre and not full_llm.get(tid, {}).get("llm_genre"))
+    ]
+    if state_key and (state is None or changed_positions or removed):
+        ids = library.ids
+        _generation_state_set(state_key, signature, {
+            "track_ids": ids,
+            "groups": {
+                name: {key: [ids[i] for i in members] for key, members in buckets.items()}
+                for name, buckets in groups.items()
+            },
+            "unresolved": unresolved,
+            "genre_hint": sorted(existing_spotify_genres),
+        }, state["created_at"] if state else None)
 
-        for track in unique_tracks:
-            raw_genres: set[str] = set()
+    # build a song name lookup so the frontend can show real names in the preview panel
+    names, artist_names = library.names, library.artist_names
+    track_details = {
+        tid: {
+            "name": names[i],
+            "artists": ", ".join(artist_names[r] for r in library.artists(i))
+        }
+        for i, tid in enumerate(library.ids)
+    }
 
-            for artist in track["artists"]:
-                raw_genres.update(artist_id_to_genres.get(artist["id"], []))
+    return {
+        "status": "ok",
+        "results": results,
+        "track_details": track_details,
+    }
 
-            # if Spotify had nothing, use what the AI suggested
-            if not raw_genres:
-                llm_genre = full_llm.get(track["track_id"], {}).get("llm_genre")
-                if llm_genre:
-                    raw_genres.add(llm_genre)
 
-            # normalise into cleaner broader genre names
-            track_genres: set[str] = set()
-            for g in raw_genres:
-                track_genres.add(_normalise_genre(g))
+# -------------------------------------------------------------------
+# Compact result format — the normal result repeats 22-character track ids
+# in every genre/language/artist group and again in track_details, which
+# runs to megabytes for big libraries. the compact one (opt-in, see
+# _wants_compact) lists each track once in columns and groups point at
+# tracks by index, delta-encoded since group members keep playlist order:
+#   {"format": "compact", "version": 1,
+#    "tracks": {"id": [...], "name": [...], "artists": [index into artist_names]},
+#    "artist_names": [...], "groups": {"genre": {"Pop": [0, 3, 1, ...]}}}
+# -------------------------------------------------------------------
 
-            if not track_genres:
-                track_genres = {"Other"}
+COMPACT_FORMAT_VERSION = 1
+COMPACT_MEDIA_TYPE = "application/vnd.autoplaylist.compact+json"
+
+# brotli is optional (pip install brotli), gzip from the middleware otherwise
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _compact_result(result: dict) -> dict:
+    details = result.get("track_details", {})
+    ids = list(details)  # same order as the tracks were processed in
+    index = {tid: i for i, tid in enumerate(ids)}
+    # the same "Artist A, Artist B" string shows up on lots of tracks, so it's a table too
+    artist_names: list[str] = []
+    artist_index: dict[str, int] = {}
+    artists = []
+    for tid in ids:
+        name = details[tid]["artists"]
+        if name not in artist_index:
+            artist_index[name] = len(artist_names)
+            artist_names.append(name)
+        artists.append(artist_index[name])
+
+    groups = {}
+    for kind, buckets in result.get("results", {}).items():
+        groups[kind] = {}
+        for name, tids in buckets.items():
+            deltas, prev = [], 0
+            for tid in tids:
+                deltas.append(index[tid] - prev)
+                prev = index[tid]
+            groups[kind][name] = deltas
+
+    compact = {k: v for k, v in result.items() if k not in ("results", "track_details")}
+    compact.update({
+        "format": "compact",
+        "version": COMPACT_FORMAT_VERSION,
+        "tracks": {"id": ids, "name": [details[tid]["name"] for tid in ids], "artists": artists},
+        "artist_names": artist_names,
+        "groups": groups,
+    })
+    return compact
 
-            for genre in track_genres:
-                genre_tracks.setdefault(genre, [])
-                if allow_dupes or track["track_id"] not in genre_tracks[genre]:
-                    genre_tracks[genre].append(track["track_id"])
 
-        # sort by most songs, take the top N
-        sorted_genres = sorted(genre_tracks.items(), key=lambda x: len(x[1]), reverse=True)
-        for name, tids in sorted_genres[:max_genres]:
-            genre_results[name] = tids
+def _wants_compact(request: Request) -> bool:
+    # the frontend asks for it through the Accept header, ?format=compact works too (for plain links)
+    return (
+        request.query_params.get("format") == "compact"
+        or COMPACT_MEDIA_TYPE in request.headers.get("accept", "")
+    )
 
-    # --- step 7: build language playlists ---
-    # entirely AI-driven since Spotify has no language data at all
-    language_results: dict[str, list[str]] = {}
 
-    if want_language:
-        lang_tracks: dict[str, list[str]] = {}
+def _json_response(request: Request, body: dict, compact: bool) -> Response:
+    # serialised by hand (no pretty separators, no jsonable_encoder pass) since results can be big
+    data = json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode()
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if brotli is not None and len(data) >= 1024 and "br" in request.headers.get("accept-encoding", ""):
+        data = brotli.compress(data, quality=5)
+        headers["Content-Encoding"] = "br"  # the gzip middleware leaves encoded responses alone
+    return Response(data, media_type=COMPACT_MEDIA_TYPE if compact else "application/json", headers=headers)
 
-        for track in unique_tracks:
-            lang = full_llm.get(track["track_id"], {}).get("language") or "Unknown"
-            lang_tracks.setdefault(lang, [])
-            if allow_dupes or track["track_id"] not in lang_tracks[lang]:
-                lang_tracks[lang].append(track["track_id"])
 
-        sorted_langs = sorted(lang_tracks.items(), key=lambda x: len(x[1]), reverse=True)
-        for name, tids in sorted_langs[:max_languages]:
-            language_results[name] = tids
+# =======================================================================
+# JOBS
+# /generate used to do everything inside one HTTP request, which timed out
+# behind the proxy on big libraries. now it just queues a job and returns
+# its id, the frontend polls /jobs/{id} (or listens on /jobs/{id}/events)
+# the job id is a random uuid, so knowing it is what gives you access
+# =======================================================================
 
-    # build a song name lookup so the frontend can show real names in the preview panel
-    track_details = {
-        t["track_id"]: {
-            "name": t["name"],
-            "artists": ", ".join(a["name"] for a in t["artists"])
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_HOURS = float(os.getenv("JOB_TTL_HOURS", "6"))
+# every uvicorn worker shares cache.db, so a queued/running job belongs to the
+# process that last touched it within this many seconds. each process renews
+# its own every quarter of that; once a job goes stale (its process died) the
+# next worker to look takes it over
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+class Progress:
+    # thread-safe counters for one job, every change bumps `version`
+    # so the SSE stream knows when there's something new to send
+    def __init__(self, on_stage=None):
+        self._cond = threading.Condition()
+        self._on_stage = on_stage  # called (outside the lock) whenever the stage changes
+        self.version = 0
+        self.data = {
+            "stage": "queued",
+            "tracks_fetched": 0,
+            "tracks_total": 0,
+            "artists_total": 0,
+            "artists_resolved": 0,
+            "llm_cached": 0,
+            "llm_batches_total": 0,
+            "llm_batches_done": 0,
+            "llm_tracks_total": 0,
+            "llm_tracks_done": 0,
+            "llm_deferred": 0,
+            "llm_shared": 0,
+            "tracks_new": 0,
+            "tracks_removed": 0,
         }
-        for t in unique_tracks
+        # seconds spent in each stage, filled in as the stage moves on
+        self.timings: dict[str, float] = {}
+        self._stage_started = time.monotonic()
+
+    def set(self, **fields):
+        with self._cond:
+            if "stage" in fields and fields["stage"] != self.data["stage"]:
+                now = time.monotonic()
+                stage, elapsed = self.data["stage"], now - self._stage_started
+                self.timings[stage] = round(self.timings.get(stage, 0) + elapsed, 3)
+                metrics.observe("pipeline_stage_seconds", elapsed, stage=stage)
+                self._stage_started = now
+            self.data.update(fields)
+            self.version += 1
+            self._cond.notify_all()
+        if "stage" in fields and self._on_stage:
+            self._on_stage()
+
+    def add(self, key: str, n: int = 1):
+        with self._cond:
+            self.data[key] = self.data.get(key, 0) + n
+            self.version += 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self.data)
+
+
+class Job:
+    def __init__(self, job_id: str, request: dict, status: str = "queued"):
+        self.id = job_id
+        self.request = request  # playlist_ids, options and the caller's Authorization header
+        self.status = status    # queued -> running -> done / error
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.resumed = False
+        self.progress = Progress(on_stage=lambda: _job_save(self))
+        self._compact: dict | None = None  # built the first time someone asks for it
+
+    def to_dict(self, compact: bool = False, with_result: bool = True) -> dict:
+        out = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress.snapshot(),
+            "resumed": self.resumed,
+        }
+        if self.result is not None and with_result:
+            if compact and self._compact is None:
+                self._compact = _compact_result(self.result)
+            out["result"] = self._compact if compact else self.result
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+jobs: dict[str, Job] = {}
+jobs_lock = threading.Lock()
+
+
+def _job_save(job: Job):
+    # persists the job so a restart can pick it back up
+    # the auth header is only kept while the job still needs it
+    request = job.request if job.status in ("queued", "running") else {
+        k: v for k, v in job.request.items() if k != "authorization"
     }
+    con = _db()
+    with con:
+        con.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, request, progress, result, error, updated_at, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job.id, job.status, json.dumps(request), json.dumps(job.progress.snapshot()),
+                json.dumps(job.result) if job.result is not None else None, job.error, time.time(), JOB_OWNER,
+            )
+        )
+
+
+def _job_load(job_id: str, with_result: bool = True) -> Job | None:
+    # for jobs that aren't in this process's memory: finished before a restart,
+    # or running in another worker
+    row = _db().execute(
+        f"SELECT status, request, progress, {'result' if with_result else 'NULL'}, error FROM jobs WHERE job_id = ?",
+        (job_id,)
+    ).fetchone()
+    if not row:
+        return None
+    job = Job(job_id, json.loads(row[1]), status=row[0])
+    job.progress.data.update(json.loads(row[2] or "{}"))
+    job.result = json.loads(row[3]) if row[3] else None
+    job.error = row[4]
+    return job
+
+
+def _job_cleanup():
+    # forgets finished jobs older than JOB_TTL_HOURS, both in memory and on disk
+    cutoff = time.time() - JOB_TTL_HOURS * 3600
+    con = _db()
+    with con:
+        old = [r[0] for r in con.execute(
+            "SELECT job_id FROM jobs WHERE updated_at < ? AND status IN ('done', 'error')", (cutoff,)
+        ).fetchall()]
+        con.execute("DELETE FROM jobs WHERE updated_at < ? AND status IN ('done', 'error')", (cutoff,))
+    with jobs_lock:
+        for job_id in old:
+            jobs.pop(job_id, None)
+
+
+def _run_job(job: Job):
+    job.status = "running"
+    _job_save(job)
+    try:
+        sp = get_spotify_client(job.request.get("authorization"))
+        options = job.request.get("options", {})
+        job.result = _run_pipeline(sp, job.request.get("playlist_ids", []), options, job.progress)
+        if options.get("timings"):
+            # same dict the progress fills in, so the last stage's time lands
+            # in it when the stage moves to "done" just below
+            job.result["timings"] = job.progress.timings
+        job.status = "done"
+        job.progress.set(stage="done")
+        metrics.inc("generate_jobs_total", status="done")
+    except Exception as e:
+        if isinstance(e, spotipy.SpotifyException) and e.http_status == 401:
+            job.error = "Spotify token expired, please generate again"
+        else:
+            job.error = str(e) or type(e).__name__
+        print(f"job {job.id} failed: {job.error}")
+        job.status = "error"
+        job.progress.set(stage="error")
+        metrics.inc("generate_jobs_total", status="error")
+
+
+def _submit_job(job: Job):
+    with jobs_lock:
+        jobs[job.id] = job
+    _job_save(job)
+    job_executor.submit(_run_job, job)
+
+
+def _resume_jobs():
+    # anything that was queued or running when its server went down gets restarted
+    # finished LLM batches are already in song_cache, so it carries on from there.
+    # jobs whose lease is still fresh belong to a live process (a sibling worker,
+    # or this one) and are left alone. the claim is one UPDATE stamped with a
+    # token nobody else has, so two workers starting at once can't both take a job
+    claim = f"{JOB_OWNER}:{uuid.uuid4().hex[:8]}"
+    now = time.time()
+    con = _db()
+    with con:
+        con.execute(
+            "UPDATE jobs SET owner = ?, updated_at = ? WHERE status IN ('queued', 'running') AND updated_at < ?",
+            (claim, now, now - JOB_LEASE_SECONDS)
+        )
+    rows = con.execute("SELECT job_id FROM jobs WHERE owner = ?", (claim,)).fetchall()
+    for (job_id,) in rows:
+        job = _job_load(job_id)
+        job.status = "queued"
+        job.resumed = True
+        job.progress = Progress(on_stage=lambda job=job: _job_save(job))
+        _submit_job(job)
+
+
+def _renew_job_leases():
+    # keeps this process's queued/running jobs from looking abandoned
+    con = _db()
+    with con:
+        con.execute(
+            "UPDATE jobs SET updated_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+            (time.time(), JOB_OWNER)
+        )
+
+
+_jobs_stop = threading.Event()
+
+
+def _job_lease_worker():
+    # background thread started on app startup, also picks up jobs another
+    # worker dropped by dying
+    while not _jobs_stop.wait(JOB_LEASE_SECONDS / 4):
+        try:
+            _renew_job_leases()
+            _resume_jobs()
+        except Exception as e:
+            print(f"job lease error: {e}")
+
+
+def _get_job(job_id: str) -> Job:
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        job = _job_load(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def _active_jobs(authorization: str | None) -> int:
+    key = _user_key(authorization)
+    with jobs_lock:
+        return sum(
+            1 for job in jobs.values()
+            if job.status in ("queued", "running") and _user_key(job.request.get("authorization")) == key
+        )
+
+
+@app.post("/generate")
+async def generate(request_body: dict, authorization: str = Header(None)):
+    # checks the token is there, queues the pipeline and returns right away
+    get_spotify_client(authorization)
+    # the job pool is shared, so one user can't queue up enough work to starve everyone else
+    if _active_jobs(authorization) >= USER_MAX_JOBS:
+        raise HTTPException(status_code=429, detail="You already have playlists generating, wait for those to finish")
+    job = Job(uuid.uuid4().hex, {
+        "playlist_ids": request_body.get("playlist_ids", []),
+        "options": request_body.get("options", {}),
+        "authorization": authorization,
+    })
+
+    def submit():
+        _job_cleanup()
+        _submit_job(job)
+
+    await _offload("light", authorization, submit)
+    return {"status": "queued", "job_id": job.id}
+
+
+async def _get_job_async(job_id: str) -> Job:
+    # in-memory jobs answer straight away, only old ones need a trip to sqlite
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is not None:
+        return job
+    return await anyio.to_thread.run_sync(_get_job, job_id, limiter=_thread_pool("light"))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    # polling endpoint — status, per-stage progress, and the result once it's done
+    job = await _get_job_async(job_id)
+    compact = _wants_compact(request)
+    if job.result is None:
+        return job.to_dict()
+    body = await anyio.to_thread.run_sync(job.to_dict, compact, limiter=_thread_pool("light"))
+    return await anyio.to_thread.run_sync(_json_response, request, body, compact, limiter=_thread_pool("light"))
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    # server-sent events version of /jobs/{id}, sends a message whenever progress moves
+    # checks every half second instead of blocking a thread per listener.
+    # events only carry progress: the last one has status done/error and a
+    # result_url, and the result itself comes from /jobs/{id} — that's
+    # serialised off the event loop and compressed, an SSE stream is neither
+    job = await _get_job_async(job_id)
+    with jobs_lock:
+        local = jobs.get(job_id) is job
+
+    def event() -> str:
+        body = job.to_dict(with_result=False)
+        if job.status == "done":
+            body["result_url"] = f"/jobs/{job.id}"
+        return f"data: {json.dumps(body, separators=(',', ':'))}\n\n"
+
+    async def stream():
+        nonlocal job
+        last = None
+        while True:
+            if not local:
+                # another worker has this job (or it finished before a restart),
+                # so all we can see is what gets saved to the db — read it again
+                job = await anyio.to_thread.run_sync(
+                    functools.partial(_job_load, job_id, with_result=False), limiter=_thread_pool("light")
+                ) or job
+            # status is read first: a job flips to done just before its last
+            # progress bump, so a finished job always gets one more event
+            finished = job.status in ("done", "error")
+            message = None if local else event()
+            mark = job.progress.version if local else message
+            if mark != last or finished:
+                last = mark
+                yield message or event()
+            if finished:
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
 
+# =======================================================================
+# METRICS
+# Prometheus scrape endpoint, counters are filled in all over the file
+# =======================================================================
+
+def _metric_gauges() -> dict[str, float]:
+    # point-in-time numbers worked out when /metrics is scraped
+    with jobs_lock:
+        active = sum(1 for job in jobs.values() if job.status in ("queued", "running"))
     return {
-        "status": "ok",
-        "results": {
-            "genre":    genre_results,
-            "language": language_results,
-            "artist":   artist_results,
-        },
-        "track_details": track_details,
+        "jobs_active": active,
+        "llm_pending": _db().execute("SELECT COUNT(*) FROM llm_pending").fetchone()[0],
+        "groq_circuit_open": int(groq_breaker.state != "closed"),
+        "groq_batch_size": groq_batch_size.current(),
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    gauges = await anyio.to_thread.run_sync(_metric_gauges, limiter=_thread_pool("light"))
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
 # =======================================================================
 # CREATE PLAYLISTS
 # takes the user's final selection and actually creates them on Spotify
 # =======================================================================
 
-@app.post("/create-playlists")
-def create_playlists(request_body: dict, authorization: str = Header(None)):
-    sp = get_spotify_client(authorization)
-    user_id = sp.current_user()["id"]
-    playlists = request_body.get("playlists", [])
-    created = []
-
-    for entry in playlists:
-        name = entry.get("name", "AutoPlaylist")
-        track_ids = entry.get("track_ids", [])
-        if not track_ids:
-            continue
-
-        # create an empty playlist first, then fill it
+PLAYLIST_PREFIX = "AP: "
+
+
+def _own_ap_playlists(sp: spotipy.Spotify, user_id: str) -> dict[str, str]:
+    # name -> playlist id for the "AP: " playlists this user already owns
+    pages = _fetch_pages(lambda off: sp.current_user_playlists(limit=50, offset=off), 50)
+    found = {}
+    for page in pages:
+        for item in page["items"]:
+            if not item or (item.get("owner") or {}).get("id") != user_id:
+                continue
+            if item["name"].startswith(PLAYLIST_PREFIX):
+                found.setdefault(item["name"], item["id"])  # oldest duplicate from old runs loses
+    return found
+
+
+def _sync_playlist(
+    sp: spotipy.Spotify, user_id: str, name: str, track_ids: list[str], existing_id: str | None, prune: bool = False
+) -> dict:
+    # creates the playlist, or if we made it before, only adds what's missing
+    # (and with prune, removes what's no longer in the group — including songs
+    # the user added by hand, so that's only done when asked for)
+    # Spotify only lets you add/remove 100 tracks per request so we batch it
+    if existing_id:
+        playlist_id = existing_id
+        current = set(_fetch_playlist_tracks(sp, playlist_id).ids)
+        wanted = set(track_ids)
+        to_add = [tid for tid in dict.fromkeys(track_ids) if tid not in current]
+        to_remove = [tid for tid in current if tid not in wanted] if prune else []
+        action = "updated" if to_add or to_remove else "unchanged"
+    else:
         # we prefix with "AP: " so the user knows which ones we made
-        new_playlist = sp.user_playlist_create(
+        new_playlist = _spotify_call(
+            sp.user_playlist_create,
             user=user_id,
-            name=f"AP: {name}",
+            name=f"{PLAYLIST_PREFIX}{name}",
             public=True,
             description="Created by AutoPlaylist"
         )
         playlist_id = new_playlist["id"]
+        to_add, to_remove = list(dict.fromkeys(track_ids)), []
+        action = "created"
 
-        # Spotify only lets you add 100 tracks per request so we batch it
-        track_uris = [f"spotify:track:{tid}" for tid in track_ids]
-        for i in range(0, len(track_uris), 100):
-            sp.playlist_add_items(playlist_id, track_uris[i:i+100])
+    remove_uris = [f"spotify:track:{tid}" for tid in to_remove]
+    for i in range(0, len(remove_uris), 100):
+        _spotify_call(sp.playlist_remove_all_occurrences_of_items, playlist_id, remove_uris[i:i+100])
+    add_uris = [f"spotify:track:{tid}" for tid in to_add]
+    for i in range(0, len(add_uris), 100):
+        _spotify_call(sp.playlist_add_items, playlist_id, add_uris[i:i+100])
 
-        created.append({
-            "name": name,
-            "playlist_id": playlist_id,
-            "track_count": len(track_ids)
-        })
+    return {
+        "name": name,
+        "playlist_id": playlist_id,
+        "track_count": len(track_ids),
+        "action": action,
+        "added": len(to_add),
+        "removed": len(to_remove),
+    }
+
+
+@app.post("/create-playlists")
+async def create_playlists(request_body: dict, authorization: str = Header(None)):
+    sp = get_spotify_client(authorization)
+    return await _offload("heavy", authorization, _create_playlists, sp, request_body)
+
+
+def _create_playlists(sp: spotipy.Spotify, request_body: dict) -> dict:
+    # mode "create" (default) always makes new playlists, mode "update" reuses
+    # an existing "AP: <name>" playlist so running this twice doesn't make
+    # duplicates. updates only add songs unless "prune": true is passed too
+    user_id = _current_user_id(sp)
+    mode = request_body.get("mode", "create")
+    if mode not in ("update", "create"):
+        raise HTTPException(status_code=400, detail="mode must be 'update' or 'create'")
+    prune = bool(request_body.get("prune", False))
+    playlists = [e for e in request_body.get("playlists", []) if e.get("track_ids")]
+    if not playlists:
+        return {"status": "ok", "created": [], "failed": []}
+
+    existing = _own_ap_playlists(sp, user_id) if mode == "update" else {}
+
+    # each playlist is independent, so they're created/filled at the same time
+    def sync(entry: dict) -> dict:
+        name = entry.get("name", "AutoPlaylist")
+        try:
+            return _sync_playlist(
+                sp, user_id, name, entry["track_ids"], existing.get(f"{PLAYLIST_PREFIX}{name}"), prune
+            )
+        except spotipy.SpotifyException as e:
+            print(f"create playlist error ({name}): {e}")
+            return {"name": name, "error": e.msg}
+        except requests.RequestException as e:
+            # timeouts and dropped connections aren't wrapped by spotipy
+            print(f"create playlist error ({name}): {e}")
+            return {"name": name, "error": f"couldn't reach Spotify ({type(e).__name__})"}
+
+    with ThreadPoolExecutor(max_workers=min(SPOTIFY_WORKERS, len(playlists))) as pool:
+        results = list(pool.map(sync, playlists))
+
+    created = [r for r in results if "error" not in r]
+    failed = [r for r in results if "error" in r]
+    for r in created:
+        metrics.inc("create_playlists_total", action=r["action"])
+    metrics.inc("create_playlists_total", len(failed), action="failed")
+    if not created:
+        raise HTTPException(status_code=502, detail=f"Failed to create playlists: {failed[0]['error']}")
+    return {"status": "ok" if not failed else "partial", "created": created, "failed": failed}
+
+
+# =======================================================================
+# CACHE EXPORT / IMPORT
+# warms a fresh node (or a new Redis) from one that's been running:
+#   python main.py export-cache cache.jsonl
+#   CACHE_URL=redis://new-host:6379 python main.py import-cache cache.jsonl
+# =======================================================================
 
-    return {"status": "ok", "created": created}
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="export or import the AutoPlaylist caches")
+    parser.add_argument("command", choices=["export-cache", "import-cache"])
+    parser.add_argument("path", help="JSON lines file, - for stdout/stdin")
+    args = parser.parse_args()
+
+    _init_db()
+    if args.command == "export-cache":
+        out = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8")
+        with out:
+            count = cache_export(out)
+        print(f"exported {count} entries", file=sys.stderr)
+    else:
+        src = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+        with src:
+            count = cache_import(src)
+        print(f"imported {count} entries", file=sys.stderr)
@@ -7,9 +7,16 @@
  *   2. Saves the new access token to Zustand
  *   3. Retries the original request once
  *   4. If refresh also fails → clears tokens so the user is sent back to login
+ *
+ * It also asks for the compact result format (see expandResult below), the
+ * browser handles gzip/brotli on its own.
  */
 
 import { useStore } from './store'
+import type { GeneratedResults, TrackDetail } from './store'
+
+// Backend sends /jobs results in this format when we list it in Accept
+const COMPACT_TYPE = 'application/vnd.autoplaylist.compact+json'
 
 //const BASE = 'http://127.0.0.1:8888'
 const BASE = 'https://auto-playlist-maker-for-spotify-production.up.railway.app'
@@ -25,6 +32,9 @@ export async function apiFetch(
     headers.set('Authorization', `Bearer ${accessToken}`)
   }
   headers.set('Content-Type', 'application/json')
+  if (!headers.has('Accept')) {
+    headers.set('Accept', `${COMPACT_TYPE}, application/json;q=0.9`)
+  }
 
   const response = await fetch(`${BASE}${path}`, { ...options, headers })
 
@@ -63,3 +73,41 @@ export async function apiFetch(
     return response
   }
 }
+
+// ── Compact results ────────────────────────────────────────────────────────
+
+interface CompactResult {
+  format: 'compact'
+  version: number
+  tracks: { id: string[]; name: string[]; artists: number[] }
+  artist_names: string[]
+  groups: Record<string, Record<string, number[]>>
+}
+
+/**
+ * Turns a /jobs result into { results, track_details } whichever format it
+ * came in. Compact results list every track once and groups point at them by
+ * index, delta-encoded (each number is the gap from the previous one).
+ */
+export function expandResult(result: any): {
+  results: GeneratedResults
+  track_details: Record<string, TrackDetail>
+} {
+  if (result?.format !== 'compact') {
+    return { results: result.results, track_details: result.track_details || {} }
+  }
+  const { tracks, artist_names, groups } = result as CompactResult
+  const track_details: Record<string, TrackDetail> = {}
+  tracks.id.forEach((id, i) => {
+    track_details[id] = { name: tracks.name[i], artists: artist_names[tracks.artists[i]] }
+  })
+  const results: Record<string, Record<string, string[]>> = {}
+  for (const [kind, buckets] of Object.entries(groups)) {
+    results[kind] = {}
+    for (const [name, deltas] of Object.entries(buckets)) {
+      let index = 0
+      results[kind][name] = deltas.map((d) => tracks.id[(index += d)])
+    }
+  }
+  return { results: results as unknown as GeneratedResults, track_details }
+}
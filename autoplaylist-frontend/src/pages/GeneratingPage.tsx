@@ -1,38 +1,72 @@
 import { useEffect, useRef, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { useStore } from '../store'
-import { apiFetch } from '../api'
-
-const STEPS = [
-  'Fetching tracks from selected playlists...',
-  'Reading artist and genre data...',
-  'Detecting languages...',
-  'Grouping by genre...',
-  'Grouping by artist...',
-  'Doing crazy background research',
-  'Finalising results...',
-]
+import { apiFetch, expandResult } from '../api'
+
+// Backend job stages → what we show the user, in pipeline order
+const STAGES: Record<string, string> = {
+  queued: 'Waiting for a free worker...',
+  fetching_tracks: 'Fetching tracks from selected playlists...',
+  resolving_artists: 'Reading artist and genre data...',
+  classifying: 'Detecting languages and genres...',
+  grouping: 'Grouping your playlists...',
+  done: 'Finalising results...',
+}
+const STAGE_ORDER = Object.keys(STAGES)
+
+// How often we ask the backend how the job is going
+const POLL_MS = 1500
+
+interface JobProgress {
+  stage: string
+  tracks_fetched: number
+  artists_total: number
+  artists_resolved: number
+  llm_tracks_total: number
+  llm_tracks_done: number
+}
+
+// Turns the job's counters into the line under the title
+function describe(p: JobProgress): string {
+  if (p.stage === 'fetching_tracks' && p.tracks_fetched)
+    return `Fetched ${p.tracks_fetched} tracks...`
+  if (p.stage === 'resolving_artists' && p.artists_total)
+    return `Reading artist data (${p.artists_resolved}/${p.artists_total})...`
+  if (p.stage === 'classifying' && p.llm_tracks_total)
+    return `Detecting languages and genres (${p.llm_tracks_done}/${p.llm_tracks_total} songs)...`
+  return STAGES[p.stage] ?? STAGES.queued
+}
+
+// Overall bar: each stage gets an equal slice, classifying fills its slice song by song
+function percent(p: JobProgress): number {
+  const idx = Math.max(0, STAGE_ORDER.indexOf(p.stage))
+  let within = 0
+  if (p.stage === 'resolving_artists' && p.artists_total) within = p.artists_resolved / p.artists_total
+  if (p.stage === 'classifying' && p.llm_tracks_total) within = Math.min(1, p.llm_tracks_done / p.llm_tracks_total)
+  return ((idx + within) / (STAGE_ORDER.length - 1)) * 100
+}
+
+const sleep = (ms: number) => new Promise((r) => setTimeout(r, ms))
 
 export default function GeneratingPage() {
   const navigate = useNavigate()
   const { selectedPlaylists, enabledGenerators, generatorSettings, setGeneratedResults } = useStore()
 
-  const [stepIndex, setStepIndex] = useState(0)
+  const [status, setStatus] = useState(STAGES.queued)
+  const [progress, setProgress] = useState(0)
   const [error, setError] = useState<string | null>(null)
   const hasRun = useRef(false) // prevents React StrictMode double-invocation
+  const mounted = useRef(true) // stops polling once we leave the page
 
   useEffect(() => {
+    mounted.current = true
     // Guard against React StrictMode running effects twice in development
-    if (hasRun.current) return
+    if (hasRun.current) return () => { mounted.current = false }
     hasRun.current = true
 
-    // Cycle through status messages while waiting
-    const interval = setInterval(() => {
-      setStepIndex((i) => Math.min(i + 1, STEPS.length - 1))
-    }, 1800)
-
     const run = async () => {
       try {
+        // /generate just queues a background job and hands back its id
         const res = await apiFetch('/generate', {
           method: 'POST',
           body: JSON.stringify({
@@ -50,20 +84,35 @@ export default function GeneratingPage() {
           }),
         })
 
+        if (res.status === 429) throw new Error((await res.json()).detail)
         if (!res.ok) throw new Error('Generation failed')
-        const data = await res.json()
+        const { job_id } = await res.json()
 
-        setGeneratedResults(data.results, data.track_details || {})
-        clearInterval(interval)
-        navigate('/review')
+        // Poll the job until it finishes
+        while (mounted.current) {
+          const jobRes = await apiFetch(`/jobs/${job_id}`)
+          if (!jobRes.ok) throw new Error('Generation failed')
+          const job = await jobRes.json()
+
+          setStatus(describe(job.progress))
+          setProgress(percent(job.progress))
+
+          if (job.status === 'error') throw new Error(job.error || 'Generation failed')
+          if (job.status === 'done') {
+            const { results, track_details } = expandResult(job.result)
+            setGeneratedResults(results, track_details)
+            navigate('/review')
+            return
+          }
+          await sleep(POLL_MS)
+        }
       } catch (e: any) {
-        clearInterval(interval)
         setError(e.message)
       }
     }
 
     run()
-    return () => clearInterval(interval)
+    return () => { mounted.current = false }
   }, [])
 
   return (
@@ -89,12 +138,12 @@ export default function GeneratingPage() {
             </div>
 
             <h2 className="gen-title">Generating your playlists</h2>
-            <p className="gen-status">{STEPS[stepIndex]}</p>
+            <p className="gen-status">{status}</p>
 
             <div className="gen-progress">
               <div
                 className="gen-progress-bar"
-                style={{ width: `${((stepIndex + 1) / STEPS.length) * 100}%` }}
+                style={{ width: `${Math.max(progress, 4)}%` }}
               />
             </div>
 
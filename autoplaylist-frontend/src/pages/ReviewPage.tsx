@@ -41,6 +41,8 @@ export default function ReviewPage() {
   )
   const [creating, setCreating] = useState(false)
   const [done, setDone] = useState(false)
+  const [createdCount, setCreatedCount] = useState(0)
+  const [failedNames, setFailedNames] = useState<string[]>([])
   const [error, setError] = useState<string | null>(null)
   const [expandedIdx, setExpandedIdx] = useState<number | null>(null)
 
@@ -62,6 +64,9 @@ export default function ReviewPage() {
       const res = await apiFetch('/create-playlists', {
         method: 'POST',
         body: JSON.stringify({
+          // reuse our existing AP: playlists instead of making duplicates,
+          // only ever adding songs so anything added by hand stays put
+          mode: 'update',
           playlists: selected.map((e) => ({
             name: e.name,
             track_ids: e.trackIds,
@@ -69,6 +74,10 @@ export default function ReviewPage() {
         }),
       })
       if (!res.ok) throw new Error('Failed to create playlists')
+      // status is "partial" when some of them failed, they're listed in `failed`
+      const data = await res.json()
+      setCreatedCount((data.created || []).length)
+      setFailedNames((data.failed || []).map((f: { name: string }) => f.name))
       setDone(true)
     } catch (e: any) {
       setError(e.message)
@@ -89,8 +98,13 @@ export default function ReviewPage() {
           <div className="rv-done-icon">✓</div>
           <h2 className="rv-done-title">Playlists Created!</h2>
           <p className="rv-done-sub">
-            {selected.length} playlist{selected.length > 1 ? 's' : ''} have been added to your Spotify account.
+            {createdCount} playlist{createdCount !== 1 ? 's' : ''} {createdCount !== 1 ? 'have' : 'has'} been added to your Spotify account.
           </p>
+          {failedNames.length > 0 && (
+            <p className="rv-error rv-done-failed">
+              ⚠ Couldn't create {failedNames.join(', ')}.
+            </p>
+          )}
           <button className="rv-start-over" onClick={() => { logout(); navigate('/') }}>
             Start over
           </button>
@@ -483,6 +497,7 @@ const sharedStyles = `
     color: rgba(255,255,255,0.45);
     font-size: 0.9rem; line-height: 1.7; margin-bottom: 32px;
   }
+  .rv-done-failed { margin: -20px 0 28px; line-height: 1.6; }
   .rv-start-over {
     background: rgba(255,255,255,0.07);
     border: 1px solid rgba(255,255,255,0.12);